@@ -3,7 +3,9 @@ from motor.motor_asyncio import AsyncIOMotorClient
 
 from backend.database.models.locations import (
     LocationDetailedDb,
+    LocationFacetCell,
     LocationHistory,
+    LocationProjectionState,
     LocationShortDb,
     LocationUpdateReport,
     Review,
@@ -31,6 +33,8 @@ async def init():
         LocationHistory,
         Offer,
         LocationUpdateReport,
+        LocationProjectionState,
+        LocationFacetCell,
         Chat,
     ]
 
@@ -4,7 +4,7 @@ from typing import Any
 
 from beanie import Document, PydanticObjectId
 from pydantic import BaseModel
-from pymongo import GEO2D, GEOSPHERE, IndexModel
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
 
 from backend.database.models.shared import (
     CreationInfo,
@@ -39,11 +39,23 @@ class ReviewWithId(ReviewInfo):
 class Review(Document, ReviewInfo):
     class Settings:
         name = "reviews"
+        indexes = [
+            IndexModel(
+                [("location_id", ASCENDING), ("creation_date", ASCENDING)],
+                name="location_creation_date_index",
+            ),
+            IndexModel(
+                [("user_id", ASCENDING), ("location_id", ASCENDING)],
+                name="user_location_index",
+            ),
+        ]
 
 
 class ReviewsSummary(BaseModel):
     average_rating: float
     count: int
+    # kept next to the average, so it can be updated without rounding errors
+    rating_sum: float = 0
     recent: list[ReviewWithId]
 
 
@@ -63,6 +75,8 @@ class LocationDetailed(LocationBase):
     geometry: GeoJsonObject | None
     photos: list[PhotoInfo]
     reviews: ReviewsSummary
+    # incremented with every update of the fields above, see `LocationHistoryIn`
+    version: int = 0
 
 
 class LocationDetailedDb(Document, LocationDetailed):
@@ -74,10 +88,8 @@ class LocationDetailedDb(Document, LocationDetailed):
         name = "locations"
         indexes = [
             "osm_id",
-            "activity_type",
-            # for Box queries
-            IndexModel([("location.coordinates", GEO2D)], name="location_index_GEO2D"),
-            # for Near queries
+            "activity_types",
+            # for Near and GeoWithin queries
             IndexModel([("location", GEOSPHERE)], name="location_index_GEOSPHERE"),
         ]
 
@@ -86,12 +98,39 @@ class LocationShortDb(Document, LocationShort):
     class Settings:
         name = "simple_locations"
         indexes = [
-            "activity_type",
-            IndexModel([("location.coordinates", GEO2D)], name="location_index_GEO2D"),
+            "activity_types",
             IndexModel([("location", GEOSPHERE)], name="location_index_GEOSPHERE"),
         ]
 
 
+class LocationProjectionState(Document):
+    """Progress of the projector that syncs `locations` to `simple_locations`."""
+
+    id: str
+    resume_token: dict[str, Any] | None
+    updated: Datetime
+
+    class Settings:
+        name = "location_projection_state"
+
+
+class LocationFacetCell(Document):
+    """Number of locations per activity in one cell of the facet grid."""
+
+    x: int
+    y: int
+    total: int
+    activities: dict[str, int]
+
+    class Settings:
+        name = "location_facet_cells"
+        indexes = [
+            IndexModel(
+                [("x", ASCENDING), ("y", ASCENDING)], name="cell_index", unique=True
+            ),
+        ]
+
+
 class LocationNew(LocationBase):
     name: str | None = None
     tags: dict[str, Any] = {}
@@ -106,6 +145,38 @@ class LocationDetailedApi(LocationDetailed):
     id: PydanticObjectId
 
 
+class PossibleDuplicate(BaseModel):
+    id: PydanticObjectId
+    name: str | None
+    activity_types: list[str]
+    # in meters
+    distance: float
+    # likelihood of being a duplicate, between 0 and 1
+    score: float
+
+
+class LocationBulkApi(BaseModel):
+    locations: list[LocationDetailedApi]
+    missing: list[PydanticObjectId]
+
+
+class LocationFacetsApi(BaseModel):
+    # number of locations, locations with several activities count once
+    count: int
+    activity_counts: dict[str, int]
+
+
+class LocationCluster(BaseModel):
+    location: GeoJsonLocation
+    count: int
+    activity_counts: dict[str, int]
+
+
+class LocationClustersApi(BaseModel):
+    clusters: list[LocationCluster]
+    locations: list[LocationShortApi]
+
+
 class TagChangeType(str, Enum):
     ADD = "add"
     DELETE = "delete"
@@ -125,6 +196,9 @@ class LocationHistoryIn(BaseModel):
     before: dict[str, Any] | None
     after: dict[str, Any] | None
     tags: dict[str, TagChange] | None
+    # version of the location the changes are based on, if not given only the
+    # `before` data is checked
+    version: int | None = None
 
 
 class LocationHistory(Document, LocationHistoryIn):
@@ -133,6 +207,18 @@ class LocationHistory(Document, LocationHistoryIn):
 
     class Settings:
         name = "location_change_history"
+        indexes = [
+            IndexModel(
+                [("location_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)],
+                name="location_date_index",
+            ),
+        ]
+
+
+class LocationHistoryPage(BaseModel):
+    history: list[LocationHistory]
+    # pass as `cursor` to get the next page, None on the last page
+    next_cursor: str | None
 
 
 class ReviewsPage(BaseModel):
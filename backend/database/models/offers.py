@@ -1,11 +1,10 @@
 import enum
-from datetime import date
 from enum import Enum
 from typing import Annotated, Literal, Union
 
 from beanie import Document, PydanticObjectId
-from pydantic import BaseModel, Field
-from pymongo import DESCENDING, GEO2D, GEOSPHERE, IndexModel
+from pydantic import BaseModel, Field, root_validator
+from pymongo import ASCENDING, DESCENDING, GEO2D, GEOSPHERE, IndexModel
 
 from backend.util.types import Datetime, TimeSlotFixed, TimeSlotFlexible
 
@@ -15,10 +14,7 @@ from .shared import DescriptionWithTitle, GeoJsonLocation, UserBase
 class OfferType(str, Enum):
     SINGLE = "single"
     FLEXIBLE = "flexible"
-
-    # TODO: implement recurring dates
-    # BUT: search logic gets more difficult with this one...
-    # RECURRING = "recurring"
+    RECURRING = "recurring"
 
 
 class OfferVisibility(str, Enum):
@@ -60,9 +56,14 @@ OfferLocation = Annotated[
 ]
 
 
+MINUTES_PER_DAY = 24 * 60
+
+
 class Recurrence(BaseModel):
-    weekdays: int  # encoded as binary number, 255 combinations of weekdays
-    until: date
+    # encoded as binary number, bit 0 is monday like in `date.weekday()`
+    weekdays: int = Field(ge=1, le=0b1111111)
+    # last day of the recurrence, bson has no date type so its time is ignored
+    until: Datetime
 
 
 TimeSlot = TimeSlotFlexible | TimeSlotFixed
@@ -76,14 +77,38 @@ class OfferTimeFlexible(BaseModel):
 class OfferTimeSingle(BaseModel):
     type: Literal[OfferType.SINGLE] = OfferType.SINGLE
     times: TimeSlotFixed
+    # copies of `times`, stored as fields of their own to be indexed for
+    # overlap queries
+    start: Datetime | None = None
+    end: Datetime | None = None
 
+    @root_validator(skip_on_failure=True)
+    def copy_times(cls, values):
+        values["start"], values["end"] = values["times"]
+        return values
+
+
+class OfferTimeRecurring(BaseModel):
+    """
+    Recurs on the weekdays of the recurrence, every time in the same daily time
+    slot given in minutes since midnight, e.g. 17:00 - 19:30 as 1020 - 1170.
+    """
+
+    type: Literal[OfferType.RECURRING] = OfferType.RECURRING
+    recurrence: Recurrence
+    start_minute: int = Field(ge=0, lt=MINUTES_PER_DAY)
+    end_minute: int = Field(gt=0, le=MINUTES_PER_DAY)
+
+    @root_validator(skip_on_failure=True)
+    def check_slot(cls, values):
+        if values["end_minute"] <= values["start_minute"]:
+            raise ValueError("The time slot has to end after it starts")
+        return values
 
-# class OfferTimeRecurring(BaseModel):
-#
 
-# TODO: write a validator for different OfferTime modes
 OfferTime = Annotated[
-    Union[OfferTimeFlexible, OfferTimeSingle], Field(discriminator="type")
+    Union[OfferTimeFlexible, OfferTimeSingle, OfferTimeRecurring],
+    Field(discriminator="type"),
 ]
 
 
@@ -169,7 +194,21 @@ class OfferOut(OfferWithParticipants):
     location: OfferLocation | None
 
 
+class OfferAroundOut(OfferOut):
+    distance: float  # in km, to the blurred location
+
+
+class OffersPage(BaseModel):
+    offers: list[OfferOut]
+    # pass as `cursor` to get the next page, None on the last page
+    next_cursor: str | None
+
+
 class Offer(Document, OfferWithParticipants):
+    # end of the last time slot, open offers are timed out after it.
+    # None if the offer doesn't expire.
+    expires_at: Datetime | None = None
+
     class Settings:
         name = "offers"
         indexes = [
@@ -182,4 +221,42 @@ class Offer(Document, OfferWithParticipants):
             IndexModel(
                 [("blurr_info.center", GEOSPHERE)], name="blurr_location_index_GEO"
             ),
+            # offers at a location, filtered like in `_get_with_filters`
+            IndexModel(
+                [("location.id", ASCENDING), ("status", ASCENDING)],
+                name="location_status_index",
+            ),
+            # offers a user participates in or hosts, newest first (multikey)
+            IndexModel(
+                [
+                    ("participants.id", ASCENDING),
+                    ("status", ASCENDING),
+                    ("creation_date", DESCENDING),
+                    ("_id", DESCENDING),
+                ],
+                name="participants_status_date_index",
+            ),
+            IndexModel([("user_info.id", ASCENDING)], name="host_index"),
+            # open offers overlapping a search time
+            IndexModel(
+                [("time.start", ASCENDING), ("time.end", ASCENDING)],
+                name="time_index",
+                partialFilterExpression={"status": OfferStatus.OPEN.value},
+            ),
+            # open recurring offers by their daily time slot
+            IndexModel(
+                [
+                    ("time.type", ASCENDING),
+                    ("time.start_minute", ASCENDING),
+                    ("time.end_minute", ASCENDING),
+                ],
+                name="recurring_index",
+                partialFilterExpression={"status": OfferStatus.OPEN.value},
+            ),
+            # open offers by their expiry, for the sweeper to time them out
+            IndexModel(
+                [("expires_at", ASCENDING)],
+                name="expiry_index",
+                partialFilterExpression={"status": OfferStatus.OPEN.value},
+            ),
         ]
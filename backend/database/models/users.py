@@ -31,6 +31,8 @@ class UserWithoutId(UserBase):
     last_location: GeoJsonLocation | None = None
     archived_until: Datetime | None = None
     admin: bool | None = None
+    # last change of the public user info
+    last_modified: Datetime | None = None
 
 
 class UserWithAuthentication(UserWithoutId):
@@ -44,6 +46,7 @@ class User(Document, UserWithAuthentication):
         name = "users"
         indexes = [
             "username",
+            "authentication.email",
             "trust_score",
             IndexModel([("last_location", GEOSPHERE)], name="last_location_index_GEO"),
         ]
@@ -102,6 +105,7 @@ class UserRelation(Document):
 
     class Settings:
         name = "user_relations"
+        indexes = ["users"]
 
 
 class MessageType(str, Enum):
@@ -135,6 +139,7 @@ class Chat(Document):
 
     class Settings:
         name = "chats"
+        indexes = ["users"]
 
 
 class MessageOut(BaseModel):
@@ -1,12 +1,18 @@
+from backend.util import constants
+
 from .chats import ChatService
+from .expiry import OfferExpirySweeper
 from .locations import LocationService
 from .offers import OfferService
+from .projector import LocationProjector
 from .reviews import ReviewService
 from .users import RelationService, UserService
 
 user_service = UserService()
 relation_service = RelationService()
 location_service = LocationService()
-review_service = ReviewService()
+location_projector = LocationProjector(location_service)
+review_service = ReviewService(location_service)
 offer_service = OfferService()
+offer_expiry_sweeper = OfferExpirySweeper(constants.OFFER_EXPIRY_INTERVAL)
 chat_service = ChatService()
@@ -38,21 +38,12 @@ class ChatService:
     ) -> tuple[list[MessageOut], datetime]:
         time_now = datetime.utcnow()
 
-        aggregation_pipeline = [
-            # unwind the messages from chats so that every message is one document
-            {"$unwind": "$messages"},
-            # Only match documents with the timestamp greater than the poll time
-            {"$match": {"$expr": {"$gte": [{"$toDate": "$messages.time"}, last_poll]}}},
-            # project the needed data for the MessageOut model
-            {"$project": {"chat_id": "$_id", "message": "$messages"}},
-        ]
-
         # aggregates messages from the user's chats that are newer than
         # the last poll time
         new_messages = (
             await self.get_all_chats(user)
             .aggregate(
-                aggregation_pipeline,
+                self.new_messages_pipeline(last_poll),
                 projection_model=MessageOut,
             )
             .to_list()
@@ -60,6 +51,16 @@ class ChatService:
 
         return new_messages, time_now
 
+    def new_messages_pipeline(self, last_poll: datetime) -> list[dict]:
+        return [
+            # unwind the messages from chats so that every message is one document
+            {"$unwind": "$messages"},
+            # Only match documents with the timestamp greater than the poll time
+            {"$match": {"$expr": {"$gte": [{"$toDate": "$messages.time"}, last_poll]}}},
+            # project the needed data for the MessageOut model
+            {"$project": {"chat_id": "$_id", "message": "$messages"}},
+        ]
+
     async def react_to_offer(
         self, user: User, chat: Chat, offer_id: PydanticObjectId, message: str
     ):
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any
+
+from pymongo.errors import PyMongoError
+
+from backend.database.models.offers import Offer, OfferStatus, OfferType
+
+
+def expired_filter(now: datetime) -> dict[str, Any]:
+    """Open offers whose `expires_at` has passed."""
+    return {"status": OfferStatus.OPEN.value, "expires_at": {"$lt": now}}
+
+
+class OfferExpirySweeper:
+    """
+    Times out open offers whose `expires_at` has passed. Every run is a single
+    `update_many` on the partial expiry index, so searches don't have to write
+    and only filter expired offers out until the next run.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval  # seconds between runs
+        self._task: asyncio.Task | None = None
+        self._backfill_task: asyncio.Task | None = None
+
+        self.runs = 0
+        self.failed_runs = 0
+        self.expired = 0
+        self.backfilled = 0
+        self.last_run: datetime | None = None
+        self.last_expired = 0
+        self.last_duration = 0.0  # seconds
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def start_backfill(self) -> asyncio.Task:
+        """
+        Backfill in the background. Searches need the indexed times, so this
+        runs on every startup, even if sweeping is disabled.
+        """
+        if self._backfill_task is None:
+            self._backfill_task = asyncio.create_task(self.run_backfill())
+        return self._backfill_task
+
+    async def run_backfill(self):
+        try:
+            self.backfilled = await self.backfill()
+        except PyMongoError as e:
+            print(f"Backfilling the offer expiry and times failed: {e}")
+
+    async def run(self):
+        while True:
+            try:
+                await self.sweep()
+            except PyMongoError as e:
+                self.failed_runs += 1
+                print(f"Offer expiry sweep failed: {e}")
+
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self) -> int:
+        """Time out the expired offers, returns how many there were."""
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        result = await Offer.get_motor_collection().update_many(
+            expired_filter(now),
+            {"$set": {"status": OfferStatus.TIMEOUT.value}},
+        )
+
+        self.runs += 1
+        self.expired += result.modified_count
+        self.last_run = now
+        self.last_expired = result.modified_count
+        self.last_duration = time.perf_counter() - start
+        return result.modified_count
+
+    async def backfill(self) -> int:
+        """
+        Set `expires_at` and the indexed times of offers stored before they
+        existed, returns the number of modified documents of both updates.
+        """
+        collection = Offer.get_motor_collection()
+        single = {"time.type": OfferType.SINGLE.value}
+        result = await collection.update_many(
+            {"expires_at": {"$exists": False}} | single,
+            [{"$set": {"expires_at": {"$arrayElemAt": ["$time.times", 1]}}}],
+        )
+        times = await collection.update_many(
+            {"time.start": {"$exists": False}} | single,
+            [
+                {
+                    "$set": {
+                        "time.start": {"$arrayElemAt": ["$time.times", 0]},
+                        "time.end": {"$arrayElemAt": ["$time.times", 1]},
+                    }
+                }
+            ],
+        )
+        return result.modified_count + times.modified_count
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "running": self._task is not None and not self._task.done(),
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "expired": self.expired,
+            "backfilled": self.backfilled,
+            "last_run": self.last_run,
+            "last_expired": self.last_expired,
+            "last_duration": self.last_duration,
+        }
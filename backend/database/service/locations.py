@@ -1,78 +1,947 @@
+import asyncio
+import math
+import re
+import time
+from collections import Counter
 from datetime import datetime
+from typing import Any, AsyncIterator
 
 from beanie import PydanticObjectId
 from beanie.odm.operators.find.comparison import Eq
-from beanie.operators import Box, In, Near, Pop, Pull, Push
+from beanie.odm.queries.find import FindMany
+from beanie.odm.utils.parsing import parse_obj
+from beanie.operators import GeoWithin, In, Near, Pull, Push, RegEx, Set
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 
 from backend.database.models.locations import (
+    LocationBase,
     LocationDetailed,
+    LocationDetailedApi,
     LocationDetailedDb,
+    LocationFacetCell,
     LocationHistory,
     LocationHistoryIn,
+    LocationShortApi,
     LocationShortDb,
     LocationUpdateReport,
+    PossibleDuplicate,
     Review,
     ReviewWithId,
     TagChangeType,
 )
 from backend.database.models.shared import CreationInfo, LocationCreators, PhotoInfo
 from backend.database.models.users import User
-from backend.util import errors
+from backend.util import constants, errors
+from backend.util.cache import LRUCache
+from backend.util.clustering import MAX_ZOOM as CLUSTER_MAX_ZOOM
+from backend.util.clustering import ClusterNode, ClusterPoints, PointClusterer
+from backend.util.duplicates import (
+    DUPLICATE_RADIUS,
+    DUPLICATE_THRESHOLD,
+    duplicate_score,
+    radius_in_degrees,
+)
+from backend.util.geo import bbox_to_geometry, crosses_antimeridian, split_antimeridian
+from backend.util.geodesic import EARTH_RADIUS, distance, distances
+from backend.util.pagination import decode_cursor, keyset_filter, page_of
+from backend.util.serialization import projection_for, to_api_doc
+from backend.util.spatial_index import GridIndex
+from backend.util.text_index import PrefixIndex
 from backend.util.types import BoundingBox, LongLat
 
 MAX_ONGOING_UPDATE_REPORTS = 10
+# nearest locations checked when looking for duplicates of a new one
+MAX_DUPLICATE_CANDIDATES = 20
+# edge length in degrees of the blocks the batch duplicate search works on
+DUPLICATE_BLOCK_SIZE = 1.0
 MAX_RECENT_REVIEWS = 5
 
+# bbox requests with fewer locations than this get the raw locations, not clusters
+CLUSTER_MIN_POINTS = 500
+# clusterings are precomputed per activity filter, keep only so many of them
+MAX_CACHED_CLUSTERINGS = 4
+
+# edge length in degrees of the grid tiles the bbox query cache works with
+BBOX_CACHE_TILE_SIZE = 0.1
+# bboxes covering more tiles than this are not cached
+MAX_CACHED_TILES_PER_QUERY = 64
+
+# edge length in degrees of the grid cells with precomputed activity counts
+FACET_CELL_SIZE = 0.25
+COORDINATES = "$location.coordinates"
+# Count the locations and the locations per activity of the incoming documents,
+# which have `activity_types`. Every resulting
+# document counts one activity (null for locations without any), the `locations`
+# of all of them sum up to the number of locations.
+FACET_STAGES = [
+    {
+        "$unwind": {
+            "path": "$activity_types",
+            "includeArrayIndex": "i",
+            "preserveNullAndEmptyArrays": True,
+        }
+    },
+    {
+        "$group": {
+            "_id": "$activity_types",
+            "count": {"$sum": 1},
+            "locations": {"$sum": {"$cond": [{"$gt": ["$i", 0]}, 0, 1]}},
+        }
+    },
+]
+
+# (tile x, tile y, activity filter)
+BBoxCacheKey = tuple[int, int, tuple[str, ...] | None]
+
+# Locations stored before the rating sum was introduced only have the average
+RATING_SUM = {
+    "$ifNull": [
+        "$reviews.rating_sum",
+        {"$multiply": ["$reviews.average_rating", "$reviews.count"]},
+    ]
+}
+HAS_REVIEWS = {"$gt": ["$reviews.count", 0]}
+
+# location fields that can be changed with a `LocationHistoryIn`
+UPDATABLE_FIELDS = ["name", "geometry", "activity_types", "location"]
+
+# fields of the short version that are copied from the detailed one
+SHORT_FIELDS = ["activity_types", "location", "name", "trust_score"]
+DETAILED_SHORT_PROJECTION = {f: 1 for f in SHORT_FIELDS} | {"reviews.average_rating": 1}
+
+# tags searched besides the name, matches in them rank below name matches
+SEARCH_TAGS = ["alt_name", "official_name", "operator", "sport", "leisure", "addr:city"]
+SEARCH_TAGS_PROJECTION = {f"tags.{t}": 1 for t in SEARCH_TAGS}
+NAME_SEARCH_WEIGHT = 1.0
+EARTH_RADIUS_KM = EARTH_RADIUS / 1000
+TAG_SEARCH_WEIGHT = 0.5
+
+SHORT_API_FIELDS = set(LocationShortApi.__fields__)
+SHORT_API_PROJECTION = projection_for(LocationShortApi)
+DETAILED_API_PROJECTION = projection_for(LocationDetailedApi)
+
+
+def to_short_doc(doc: dict[str, Any]) -> dict[str, Any]:
+    """Project a raw `locations` document to its `simple_locations` version."""
+    short = {"_id": doc["_id"]} | {f: doc.get(f) for f in SHORT_FIELDS}
+    short["average_rating"] = doc.get("reviews", {}).get("average_rating", 0)
+    return short
+
+
+def _search_texts(
+    name: str | None, tags: dict[str, Any]
+) -> list[tuple[str | None, float]]:
+    """Texts a location can be found by, with their weight in the ranking."""
+    texts = [(name, NAME_SEARCH_WEIGHT)]
+    for tag in SEARCH_TAGS:
+        value = tags.get(tag)
+        if isinstance(value, str):
+            texts.append((value, TAG_SEARCH_WEIGHT))
+    return texts
+
+
+def _facet_cell(long: float, lat: float) -> tuple[int, int]:
+    return math.floor(long / FACET_CELL_SIZE), math.floor(lat / FACET_CELL_SIZE)
+
+
+def _block_of(coordinates: str, axis: int, block_size: float) -> dict[str, Any]:
+    """Aggregation expression of the block index along the axis of the point."""
+    return {"$floor": {"$divide": [{"$arrayElemAt": [coordinates, axis]}, block_size]}}
+
+
+def _field_value(key: str, value: Any) -> Any:
+    """Validate a value of the location field and convert it to its stored form."""
+    value, error = LocationDetailed.__fields__[key].validate(value, {}, loc=key)
+    if error:
+        raise errors.InvalidHistory()
+    return value.dict() if isinstance(value, BaseModel) else value
+
 
 class LocationService:
     def __init__(self) -> None:
         # take care, the ODM classes might not have been initialized by beanie yet...
         # print(dir(LocationDetailed.find_all()))
-        return
+        self.index: GridIndex[LocationShortDb] | None = None
+        self._index_build: asyncio.Task | None = None
+        # writes during the index build as (id, location or None if removed),
+        # replayed once the scan is done
+        self._index_changes: list[
+            tuple[PydanticObjectId, LocationShortDb | None]
+        ] | None = None
+        # the points all clusterings are built from, with the `_locations_version`
+        # and the time they were loaded at
+        self._cluster_points: tuple[
+            ClusterPoints[PydanticObjectId], int, float
+        ] | None = None
+        self._cluster_points_load: asyncio.Task | None = None
+        # clusterings per known activity filter with the points they were built
+        # from, least recently used first
+        self._clusterings: dict[
+            tuple[str, ...] | None,
+            tuple[ClusterPoints[PydanticObjectId], PointClusterer[PydanticObjectId]],
+        ] = {}
+        self._clustering_builds: dict[tuple[str, ...] | None, asyncio.Task] = {}
+        # bumped by every write, outdates the clustering points
+        self._locations_version = 0
+        self.bbox_cache: LRUCache[BBoxCacheKey, list[dict[str, Any]]] = LRUCache(
+            constants.BBOX_CACHE_SIZE,
+            on_evict=self._forget_cached_tile,
+            ttl=constants.BBOX_CACHE_TTL,
+        )
+        # keys of all cached entries per tile, for the invalidation
+        self._cached_tiles: dict[tuple[int, int], set[BBoxCacheKey]] = {}
+        # Bumped by every invalidation of a tile, or of all tiles. Tiles
+        # invalidated while they were fetched are not cached, the fetched
+        # documents might be from before the write.
+        self._tile_generations: dict[tuple[int, int], int] = {}
+        self._cache_generation = 0
+        self.search_index: PrefixIndex[LocationShortDb] | None = None
+        self._search_index_build: asyncio.Task | None = None
+        # whether the precomputed facet cells exist, see `check_facet_cells`
+        self.facet_cells_ready = False
+        self._facet_cells_check: asyncio.Task | None = None
+        # like `_index_changes`, with the texts of the changed locations
+        self._search_index_changes: list[
+            tuple[
+                PydanticObjectId,
+                tuple[list[tuple[str | None, float]], LocationShortDb] | None,
+            ]
+        ] | None = None
+
+    def start_index_build(self) -> asyncio.Task:
+        if self._index_build is None:
+            self._index_build = asyncio.create_task(self.build_index())
+        return self._index_build
+
+    async def ensure_index(self) -> GridIndex[LocationShortDb]:
+        """Return the spatial index, building it first if needed."""
+        if self.index is None:
+            try:
+                await self.start_index_build()
+            finally:
+                if self.index is None:
+                    # allow retrying after a failed build
+                    self._index_build = None
+
+        return self.index
+
+    async def build_index(self):
+        """
+        Load all short locations into the in-memory spatial index. Locations
+        written during the scan are recorded and applied afterwards, the scan
+        might have read them before the write.
+        """
+        index: GridIndex[LocationShortDb] = GridIndex()
+        self._index_changes = []
+        try:
+            async for loc in LocationShortDb.find_all():
+                index.insert(loc.id, *loc.location.coordinates, loc)
+
+            for id, loc in self._index_changes:
+                if loc is None:
+                    index.remove(id)
+                else:
+                    index.insert(id, *loc.location.coordinates, loc)
+        finally:
+            self._index_changes = None
+
+        self.index = index
+        print(f"Spatial index built with {len(index)} locations")
+
+    def start_facet_cells_check(self) -> asyncio.Task:
+        if self._facet_cells_check is None:
+            self._facet_cells_check = asyncio.create_task(self.check_facet_cells())
+        return self._facet_cells_check
+
+    async def check_facet_cells(self):
+        """
+        Count the facet cells if there are none yet, e.g. in a database from
+        before they existed. Until then facets are counted live.
+        """
+        try:
+            if await LocationFacetCell.find_one() is None:
+                await self.rebuild_facet_cells()
+                print("Facet cells counted")
+        except PyMongoError as e:
+            print(f"Counting the facet cells failed: {e}")
+            return
+
+        self.facet_cells_ready = True
+
+    def start_search_index_build(self) -> asyncio.Task:
+        if self._search_index_build is None:
+            self._search_index_build = asyncio.create_task(self.build_search_index())
+        return self._search_index_build
+
+    async def build_search_index(self):
+        """
+        Load the names and search tags of all locations into the text index.
+        Writes during the scan are replayed afterwards, as in `build_index`.
+        """
+        index: PrefixIndex[LocationShortDb] = PrefixIndex()
+        self._search_index_changes = []
+        try:
+            cursor = LocationDetailedDb.get_motor_collection().find(
+                {}, DETAILED_SHORT_PROJECTION | SEARCH_TAGS_PROJECTION
+            )
+            async for doc in cursor:
+                loc = parse_obj(LocationShortDb, to_short_doc(doc))
+                index.insert(loc.id, _search_texts(loc.name, doc.get("tags", {})), loc)
+
+            for id, entry in self._search_index_changes:
+                if entry is None:
+                    index.remove(id)
+                else:
+                    index.insert(id, *entry)
+        finally:
+            self._search_index_changes = None
+
+        self.search_index = index
+        print(f"Search index built with {len(index)} locations")
+
+    def _search_entry_changed(self, loc: LocationShortDb, tags: dict[str, Any]):
+        if self.search_index is not None:
+            self.search_index.insert(loc.id, _search_texts(loc.name, tags), loc)
+        elif self._search_index_changes is not None:
+            self._search_index_changes.append(
+                (loc.id, (_search_texts(loc.name, tags), loc))
+            )
+
+    def _use_index(self) -> bool:
+        return (
+            constants.LOCATION_QUERY_ENGINE == constants.LOCATION_ENGINE_MEMORY
+            and self.index is not None
+        )
+
+    def _location_changed(
+        self, loc: LocationShortDb, old_coordinates: list[float] | None = None
+    ):
+        """Bring the in-memory structures up to date after a location was written."""
+        if self.index is not None:
+            self.index.insert(loc.id, *loc.location.coordinates, loc)
+        elif self._index_changes is not None:
+            self._index_changes.append((loc.id, loc))
+
+        # clusterings are rebuilt from the index on the next request
+        self._locations_version += 1
+
+        self._invalidate_cached_tile(*loc.location.coordinates)
+        if old_coordinates is not None:
+            self._invalidate_cached_tile(*old_coordinates)
+
+    def _location_removed(self, id: PydanticObjectId):
+        if self.index is not None:
+            self.index.remove(id)
+        elif self._index_changes is not None:
+            self._index_changes.append((id, None))
+        if self.search_index is not None:
+            self.search_index.remove(id)
+        elif self._search_index_changes is not None:
+            self._search_index_changes.append((id, None))
+
+        self._locations_version += 1
+        # the position of the removed location is not known anymore
+        self.bbox_cache.clear()
+        self._cached_tiles.clear()
+        self._tile_generations.clear()
+        self._cache_generation += 1
+
+    def _tile_of(self, long: float, lat: float) -> tuple[int, int]:
+        return (
+            math.floor(long / BBOX_CACHE_TILE_SIZE),
+            math.floor(lat / BBOX_CACHE_TILE_SIZE),
+        )
+
+    def _invalidate_cached_tile(self, long: float, lat: float):
+        tile = self._tile_of(long, lat)
+        self._tile_generations[tile] = self._tile_generations.get(tile, 0) + 1
+        for key in self._cached_tiles.pop(tile, set()):
+            self.bbox_cache.pop(key)
+
+    def _forget_cached_tile(self, key: BBoxCacheKey, _):
+        keys = self._cached_tiles.get(key[:2])
+        if keys is None:
+            return
+
+        keys.discard(key)
+        if not keys:
+            del self._cached_tiles[key[:2]]
 
     def get_activities_filter(self, activities):
         return In(LocationShortDb.activity_types, activities)
 
+    def _to_short(self, location: LocationDetailedDb) -> LocationShortDb:
+        return LocationShortDb(
+            **location.dict(), average_rating=location.reviews.average_rating
+        )
+
+    def _dual_write(self) -> bool:
+        """If False, the projector keeps the short collection in sync."""
+        return constants.SHORT_LOCATION_SYNC == constants.SHORT_SYNC_DUAL_WRITE
+
     async def _insert(self, location: LocationDetailedDb):
         loc = await location.insert()
-        await LocationShortDb(
-            **loc.dict(), average_rating=loc.reviews.average_rating
-        ).insert()
+        loc_short = self._to_short(loc)
+        if self._dual_write():
+            await loc_short.insert()
+        self._location_changed(loc_short)
+        self._search_entry_changed(loc_short, loc.tags)
+        await self._facets_changed(None, (loc.location.coordinates, loc.activity_types))
         return loc
 
     async def insert(
-        self, location: LocationDetailed, user_id: PydanticObjectId
-    ) -> PydanticObjectId:
-        self.check_possible_duplicate(location)
+        self,
+        location: LocationDetailed,
+        user_id: PydanticObjectId,
+        ignore_duplicates: bool = False,
+    ) -> tuple[PydanticObjectId, list[PossibleDuplicate]]:
+        """
+        Add the location, returns its id and the possible duplicates found.
+        With the "reject" policy, possible duplicates prevent the insert unless
+        `ignore_duplicates` is set.
+        """
+        duplicates = []
+        if constants.DUPLICATE_POLICY != constants.DUPLICATE_POLICY_OFF:
+            duplicates = await self.check_possible_duplicate(location)
+
+        if (
+            duplicates
+            and constants.DUPLICATE_POLICY == constants.DUPLICATE_POLICY_REJECT
+            and not ignore_duplicates
+        ):
+            raise errors.LocationPossibleDuplicate(duplicates)
 
         creation = CreationInfo(
-            created_by=LocationCreators.APP, date=datetime.now(), user_id=user_id
+            created_by=LocationCreators.APP, date=datetime.utcnow(), user_id=user_id
         )
         loc = LocationDetailedDb(
             **location.dict(), last_modified=creation.date, creation=creation
         )
         loc = await self._insert(loc)
 
-        return loc.id
+        return loc.id, duplicates
 
     async def get(self, id: PydanticObjectId) -> LocationDetailedDb | None:
         return await LocationDetailedDb.get(id)
 
+    async def get_last_modified(self, id: PydanticObjectId) -> datetime | None:
+        """Fetch only the modification date of the location, e.g. for ETags."""
+        doc = await LocationDetailedDb.get_motor_collection().find_one(
+            {"_id": id}, {"last_modified": 1}
+        )
+        return None if doc is None else doc["last_modified"]
+
     async def get_short(self, id: PydanticObjectId) -> LocationShortDb | None:
         return await LocationShortDb.get(id)
 
+    async def get_bulk(
+        self, ids: list[PydanticObjectId]
+    ) -> tuple[list[LocationDetailedDb], list[PydanticObjectId]]:
+        """
+        Fetch many locations with a single query.
+        Returns the locations in the order of `ids` and the ids that don't exist.
+        """
+        locations = await LocationDetailedDb.find(
+            In(LocationDetailedDb.id, ids)
+        ).to_list()
+        return self._in_order(ids, {loc.id: loc for loc in locations})
+
+    async def get_bulk_raw(
+        self,
+        ids: list[PydanticObjectId],
+        projection: dict[str, int] = DETAILED_API_PROJECTION,
+    ) -> tuple[list[dict[str, Any]], list[PydanticObjectId]]:
+        """
+        Like `get_bulk`, but returns raw documents with the given projection.
+        By default in the shape of `LocationDetailedApi`.
+        """
+        docs = await self._find_raw(
+            LocationDetailedDb.find(In(LocationDetailedDb.id, ids)), projection
+        )
+        return self._in_order(ids, {doc["id"]: doc for doc in docs})
+
+    def _in_order(self, ids: list[PydanticObjectId], by_id: dict):
+        ids = list(dict.fromkeys(ids))  # remove duplicates, keep the order
+        found = [by_id[id] for id in ids if id in by_id]
+        missing = [id for id in ids if id not in by_id]
+        return found, missing
+
     async def get_bbox_short(
         self, bbox: BoundingBox, activities: list[str] | None
     ) -> list[LocationShortDb]:
-        return await self.find_with_filters(
-            Box(
-                LocationShortDb.location,
-                lower_left=list(bbox[0]),
-                upper_right=list(bbox[1]),
+        if self._use_index():
+            return self._get_bbox_short_from_index(bbox, activities)
+
+        return await self._bbox_query(bbox, activities).to_list()
+
+    async def iter_bbox_short(
+        self, bbox: BoundingBox, activities: list[str] | None
+    ) -> AsyncIterator[LocationShortDb]:
+        """Like `get_bbox_short`, but yields the locations as they arrive."""
+        if self._use_index():
+            for loc in self._get_bbox_short_from_index(bbox, activities):
+                yield loc
+            return
+
+        async for loc in self._bbox_query(bbox, activities):
+            yield loc
+
+    async def get_bbox_short_raw(
+        self, bbox: BoundingBox, activities: list[str] | None
+    ) -> list[dict[str, Any]]:
+        """
+        Like `get_bbox_short`, but returns raw documents in the shape of
+        `LocationShortApi`, without validating them into models.
+        """
+        if self._use_index():
+            return [
+                loc.dict(include=SHORT_API_FIELDS)
+                for loc in self._get_bbox_short_from_index(bbox, activities)
+            ]
+
+        return await self._get_bbox_short_cached(bbox, activities)
+
+    async def _get_bbox_short_cached(
+        self, bbox: BoundingBox, activities: list[str] | None
+    ) -> list[dict[str, Any]]:
+        """
+        Split the bbox into grid tiles and take each tile from the cache if
+        possible. All missing tiles are fetched with one query and cached.
+        """
+        if crosses_antimeridian(bbox):
+            return [
+                doc
+                for part in split_antimeridian(bbox)
+                for doc in await self._get_bbox_short_cached(part, activities)
+            ]
+
+        (west, south), (east, north) = bbox
+        x0, y0 = self._tile_of(west, south)
+        x1, y1 = self._tile_of(east, north)
+        n_tiles = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if self.bbox_cache.max_size <= 0 or n_tiles > MAX_CACHED_TILES_PER_QUERY:
+            return await self._find_raw(
+                self._bbox_query(bbox, activities), SHORT_API_PROJECTION
+            )
+
+        activities_key = None if activities is None else tuple(sorted(set(activities)))
+        tiles: dict[tuple[int, int], list[dict[str, Any]]] = {}
+        missing: list[tuple[int, int]] = []
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                docs = self.bbox_cache.get((x, y, activities_key))
+                if docs is None:
+                    missing.append((x, y))
+                else:
+                    tiles[(x, y)] = docs
+
+        if missing:
+            tiles |= await self._fetch_tiles(missing, activities, activities_key)
+
+        return [
+            doc
+            for docs in tiles.values()
+            for doc in docs
+            if west <= doc["location"]["coordinates"][0] <= east
+            and south <= doc["location"]["coordinates"][1] <= north
+        ]
+
+    async def _fetch_tiles(
+        self,
+        tiles: list[tuple[int, int]],
+        activities: list[str] | None,
+        activities_key: tuple[str, ...] | None,
+    ) -> dict[tuple[int, int], list[dict[str, Any]]]:
+        size = BBOX_CACHE_TILE_SIZE
+        eps = 1e-9  # don't lose points on the tile borders to rounding errors
+        xs = [x for x, _ in tiles]
+        ys = [y for _, y in tiles]
+        bbox = (
+            (max(min(xs) * size - eps, -180), max(min(ys) * size - eps, -90)),
+            (min((max(xs) + 1) * size + eps, 180), min((max(ys) + 1) * size + eps, 90)),
+        )
+        cache_generation = self._cache_generation
+        generations = {t: self._tile_generations.get(t, 0) for t in tiles}
+        docs = await self._find_raw(
+            self._bbox_query(bbox, activities), SHORT_API_PROJECTION
+        )
+
+        fetched: dict[tuple[int, int], list[dict[str, Any]]] = {t: [] for t in tiles}
+        for doc in docs:
+            tile = self._tile_of(*doc["location"]["coordinates"])
+            if tile in fetched:
+                fetched[tile].append(doc)
+
+        for tile, tile_docs in fetched.items():
+            if (
+                self._cache_generation != cache_generation
+                or self._tile_generations.get(tile, 0) != generations[tile]
+            ):
+                continue  # written meanwhile, the documents might be stale
+
+            key = (*tile, activities_key)
+            self.bbox_cache.put(key, tile_docs)
+            self._cached_tiles.setdefault(tile, set()).add(key)
+
+        return fetched
+
+    async def _find_raw(
+        self, query: FindMany, projection: dict[str, int], limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        cursor = query.document_model.get_motor_collection().find(
+            query.get_filter_query(), projection
+        )
+        if limit:
+            cursor = cursor.limit(limit)
+
+        return [to_api_doc(doc) async for doc in cursor]
+
+    def _bbox_query(
+        self, bbox: BoundingBox, activities: list[str] | None
+    ) -> FindMany[LocationShortDb]:
+        geometry = bbox_to_geometry(bbox)
+        return self._find(
+            GeoWithin(
+                LocationShortDb.location, geometry["type"], geometry["coordinates"]
             ),
             activities=activities,
         )
 
+    def _get_bbox_short_from_index(
+        self, bbox: BoundingBox, activities: list[str] | None
+    ) -> list[LocationShortDb]:
+        predicate = None
+        if activities is not None:
+            wanted = set(activities)
+            predicate = lambda loc: not wanted.isdisjoint(loc.activity_types)
+
+        return [
+            loc
+            for part in split_antimeridian(bbox)
+            for loc in self.index.query(part, predicate)
+        ]
+
+    async def _get_cluster_points(self) -> ClusterPoints[PydanticObjectId]:
+        """
+        The points of all locations, which the clusterings are built from. Once
+        a location changed, they are reloaded in the background at most once
+        per refresh interval, until then the outdated ones are returned.
+        """
+        if self._cluster_points is None:
+            # others might wait for the same load, don't cancel it for them
+            return await asyncio.shield(self._start_cluster_points_load())
+
+        points, version, loaded_at = self._cluster_points
+        if (
+            version != self._locations_version
+            and time.monotonic() - loaded_at >= constants.CLUSTERING_REFRESH_INTERVAL
+        ):
+            self._start_cluster_points_load()
+
+        return points
+
+    def _start_cluster_points_load(self) -> asyncio.Task:
+        if self._cluster_points_load is None:
+            self._cluster_points_load = asyncio.create_task(self._load_cluster_points())
+            self._cluster_points_load.add_done_callback(self._cluster_points_loaded)
+        return self._cluster_points_load
+
+    def _cluster_points_loaded(self, task: asyncio.Task):
+        self._cluster_points_load = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Loading the clustering points failed: {task.exception()}")
+
+    async def _load_cluster_points(self) -> ClusterPoints[PydanticObjectId]:
+        version, loaded_at = self._locations_version, time.monotonic()
+        if constants.LOCATION_QUERY_ENGINE == constants.LOCATION_ENGINE_MEMORY:
+            index = await self.ensure_index()
+            points = ClusterPoints(
+                (*loc.location.coordinates, loc.activity_types, loc.id)
+                for loc in index.values()
+            )
+        else:
+            # only the fields the clustering needs, no whole documents
+            cursor = LocationShortDb.get_motor_collection().find(
+                {}, {"location.coordinates": 1, "activity_types": 1}
+            )
+            docs = [
+                (
+                    *doc["location"]["coordinates"],
+                    doc.get("activity_types", []),
+                    doc["_id"],
+                )
+                async for doc in cursor
+            ]
+            points = ClusterPoints(docs)
+
+        self._cluster_points = (points, version, loaded_at)
+        return points
+
+    async def _get_clustering(
+        self, activities: list[str] | None
+    ) -> PointClusterer[PydanticObjectId]:
+        """
+        Return the clustering for the activity filter. Only activities some
+        location has are part of the filter, which keeps the clients from
+        building clusterings for arbitrary filters.
+        """
+        points = await self._get_cluster_points()
+        key = None if activities is None else points.known(activities)
+        cached = self._clusterings.get(key)
+        if cached is not None and cached[0] is points:
+            # most recently used
+            self._clusterings[key] = self._clusterings.pop(key)
+            return cached[1]
+
+        return await asyncio.shield(self._build_clustering(key, points))
+
+    def _build_clustering(
+        self, key: tuple[str, ...] | None, points: ClusterPoints[PydanticObjectId]
+    ) -> asyncio.Task:
+        """Start building the clustering, unless it's already being built."""
+        task = self._clustering_builds.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load_clustering(key, points))
+            task.add_done_callback(lambda task: self._clustering_built(key, task))
+            self._clustering_builds[key] = task
+        return task
+
+    def _clustering_built(self, key: tuple[str, ...] | None, task: asyncio.Task):
+        del self._clustering_builds[key]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Building the clustering for {key} failed: {task.exception()}")
+
+    async def _load_clustering(
+        self, key: tuple[str, ...] | None, points: ClusterPoints[PydanticObjectId]
+    ) -> PointClusterer[PydanticObjectId]:
+        selection = None if key is None else points.having(key)
+        clustering = PointClusterer()
+        await asyncio.to_thread(clustering.load, points, selection)
+
+        self._clusterings.pop(key, None)
+        if len(self._clusterings) >= MAX_CACHED_CLUSTERINGS:
+            del self._clusterings[next(iter(self._clusterings))]
+        self._clusterings[key] = (points, clustering)
+
+        return clustering
+
+    async def get_bbox_clusters(
+        self, bbox: BoundingBox, zoom: int, activities: list[str] | None
+    ) -> tuple[list[ClusterNode[PydanticObjectId]], list[LocationShortDb]]:
+        """
+        Return the clusters and the unclustered locations inside the bbox for the
+        given zoom level. If the bbox does not contain many locations, or the
+        zoom level is too high for clusters, just the locations are returned.
+        """
+        if zoom > CLUSTER_MAX_ZOOM:
+            return [], await self.get_bbox_short(bbox, activities)
+
+        clustering = await self._get_clustering(activities)
+        nodes = [
+            node
+            for part in split_antimeridian(bbox)
+            for node in clustering.get_clusters(part, zoom)
+        ]
+
+        if sum(node.count for node in nodes) < CLUSTER_MIN_POINTS:
+            return [], await self.get_bbox_short(bbox, activities)
+
+        clusters = [node for node in nodes if node.is_cluster]
+        ids = [node.item for node in nodes if not node.is_cluster]
+        return clusters, await self._get_short_by_ids(ids)
+
+    async def _get_short_by_ids(
+        self, ids: list[PydanticObjectId]
+    ) -> list[LocationShortDb]:
+        if self._use_index():
+            return [loc for loc in map(self.index.get, ids) if loc is not None]
+
+        return await LocationShortDb.find(In(LocationShortDb.id, ids)).to_list()
+
+    async def get_bbox_facets(self, bbox: BoundingBox) -> tuple[int, dict[str, int]]:
+        """
+        Number of locations in the bbox, in total and per activity.
+
+        The grid cells completely inside the bbox are summed up from the
+        precomputed counts, only the strips along the borders are counted live.
+        Until the cells are known to exist, everything is counted live.
+        """
+        if crosses_antimeridian(bbox):
+            count, counts = 0, Counter()
+            for part in split_antimeridian(bbox):
+                part_count, part_counts = await self.get_bbox_facets(part)
+                count += part_count
+                counts.update(part_counts)
+            return count, dict(counts)
+
+        if self._use_index():
+            locations = self.index.query(bbox)
+            counts = Counter(a for loc in locations for a in set(loc.activity_types))
+            return len(locations), dict(counts)
+
+        (west, south), (east, north) = bbox
+        # the inner cells are [x0, x1) x [y0, y1)
+        x0, y0 = math.ceil(west / FACET_CELL_SIZE), math.ceil(south / FACET_CELL_SIZE)
+        x1, y1 = math.floor(east / FACET_CELL_SIZE), math.floor(north / FACET_CELL_SIZE)
+        if x1 <= x0 or y1 <= y0 or not self.facet_cells_ready:
+            query = self._bbox_query(bbox, None).get_filter_query()
+            return await self._collect_facets(self._live_facets(query))
+
+        count, activities = await self._collect_facets(
+            LocationFacetCell.get_motor_collection().aggregate(
+                [
+                    {
+                        "$match": {
+                            "x": {"$gte": x0, "$lt": x1},
+                            "y": {"$gte": y0, "$lt": y1},
+                        }
+                    },
+                    # turned into the documents FACET_STAGES expects
+                    {
+                        "$project": {
+                            "total": 1,
+                            "activities": {"$objectToArray": "$activities"},
+                        }
+                    },
+                    {
+                        "$unwind": {
+                            "path": "$activities",
+                            "includeArrayIndex": "i",
+                            "preserveNullAndEmptyArrays": True,
+                        }
+                    },
+                    {
+                        "$group": {
+                            "_id": "$activities.k",
+                            "count": {"$sum": "$activities.v"},
+                            "locations": {
+                                "$sum": {"$cond": [{"$gt": ["$i", 0]}, 0, "$total"]}
+                            },
+                        }
+                    },
+                ]
+            )
+        )
+
+        inner_west, inner_south = x0 * FACET_CELL_SIZE, y0 * FACET_CELL_SIZE
+        inner_east, inner_north = x1 * FACET_CELL_SIZE, y1 * FACET_CELL_SIZE
+        strips = [
+            ((west, south), (inner_west, north)),
+            ((inner_east, south), (east, north)),
+            ((inner_west, south), (inner_east, inner_south)),
+            ((inner_west, inner_north), (inner_east, north)),
+        ]
+        x = _block_of(COORDINATES, 0, FACET_CELL_SIZE)
+        y = _block_of(COORDINATES, 1, FACET_CELL_SIZE)
+        border_query = {
+            "$or": [self._bbox_query(s, None).get_filter_query() for s in strips],
+            # the strips overlap the inner cells on their edges
+            "$expr": {
+                "$not": {
+                    "$and": [
+                        {"$gte": [x, x0]},
+                        {"$lt": [x, x1]},
+                        {"$gte": [y, y0]},
+                        {"$lt": [y, y1]},
+                    ]
+                }
+            },
+        }
+        border_count, border_activities = await self._collect_facets(
+            self._live_facets(border_query)
+        )
+
+        counts = Counter(activities)
+        counts.update(border_activities)
+        return count + border_count, {a: n for a, n in counts.items() if n > 0}
+
+    def _live_facets(self, query: dict[str, Any]):
+        return LocationShortDb.get_motor_collection().aggregate(
+            [{"$match": query}, {"$project": {"activity_types": 1}}, *FACET_STAGES]
+        )
+
+    async def _collect_facets(self, cursor) -> tuple[int, dict[str, int]]:
+        count = 0
+        activities = {}
+        async for doc in cursor:
+            count += doc["locations"]
+            if doc["_id"] is not None and doc["count"] > 0:
+                activities[doc["_id"]] = doc["count"]
+
+        return count, activities
+
+    async def _facets_changed(
+        self,
+        old: tuple[list[float], list[str]] | None,
+        new: tuple[list[float], list[str]] | None,
+    ):
+        """Move a location's (coordinates, activities) in the precomputed counts."""
+        changes: dict[tuple[int, int], Counter] = {}
+        for entry, sign in [(old, -1), (new, 1)]:
+            if entry is None:
+                continue
+
+            coordinates, activities = entry
+            cell = changes.setdefault(_facet_cell(*coordinates), Counter())
+            cell["total"] += sign
+            for a in set(activities):
+                cell[f"activities.{a}"] += sign
+
+        for (x, y), inc in changes.items():
+            inc = {k: v for k, v in inc.items() if v != 0}
+            if inc:
+                await LocationFacetCell.get_motor_collection().update_one(
+                    {"x": x, "y": y}, {"$inc": inc}, upsert=True
+                )
+
+    async def rebuild_facet_cells(self):
+        """Recount the precomputed activity counts of all grid cells."""
+        await LocationShortDb.get_motor_collection().aggregate(
+            [
+                {
+                    "$project": {
+                        "x": _block_of(COORDINATES, 0, FACET_CELL_SIZE),
+                        "y": _block_of(COORDINATES, 1, FACET_CELL_SIZE),
+                        "activity_types": 1,
+                    }
+                },
+                FACET_STAGES[0],
+                {
+                    "$group": {
+                        "_id": {"x": "$x", "y": "$y", "activity": "$activity_types"},
+                        "count": {"$sum": 1},
+                        "locations": FACET_STAGES[1]["$group"]["locations"],
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": {"x": "$_id.x", "y": "$_id.y"},
+                        "total": {"$sum": "$locations"},
+                        "activities": {"$push": {"k": "$_id.activity", "v": "$count"}},
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "x": "$_id.x",
+                        "y": "$_id.y",
+                        "total": 1,
+                        "activities": {
+                            "$arrayToObject": {
+                                "$filter": {
+                                    "input": "$activities",
+                                    "cond": {"$ne": ["$$this.k", None]},
+                                }
+                            }
+                        },
+                    }
+                },
+                {"$out": LocationFacetCell.get_motor_collection().name},
+            ]
+        ).to_list(None)
+
     async def get_around(
         self,
         center: LongLat,
@@ -80,10 +949,55 @@ class LocationService:
         radius: float | None,
         limit: int,
     ) -> list[LocationDetailedDb]:
-        if radius and radius < 0.001 or limit == 0:
+        query = self._around_query(center, activities, radius, limit)
+        if query is None:
+            return []
+
+        return await query.to_list()
+
+    async def get_around_raw(
+        self,
+        center: LongLat,
+        activities: list[str] | None,
+        radius: float | None,
+        limit: int,
+    ) -> list[dict[str, Any]]:
+        """
+        Like `get_around`, but returns raw documents in the shape of
+        `LocationDetailedApi`, without validating them into models.
+        """
+        query = self._around_query(center, activities, radius, limit)
+        if query is None:
             return []
 
-        return await self.find_with_filters(
+        return await self._find_raw(query, DETAILED_API_PROJECTION, limit)
+
+    async def iter_around(
+        self,
+        center: LongLat,
+        activities: list[str] | None,
+        radius: float | None,
+        limit: int,
+    ) -> AsyncIterator[LocationDetailedDb]:
+        """Like `get_around`, but yields the locations as they arrive."""
+        query = self._around_query(center, activities, radius, limit)
+        if query is None:
+            return
+
+        async for loc in query:
+            yield loc
+
+    def _around_query(
+        self,
+        center: LongLat,
+        activities: list[str] | None,
+        radius: float | None,
+        limit: int,
+    ) -> FindMany[LocationDetailedDb] | None:
+        if radius and radius < 0.001 or limit == 0:
+            return None
+
+        return self._find(
             Near(
                 LocationDetailedDb.location,
                 center[0],
@@ -95,6 +1009,67 @@ class LocationService:
             return_short=False,
         )
 
+    async def search(
+        self,
+        query: str,
+        bbox: BoundingBox | None = None,
+        center: LongLat | None = None,
+        radius: float | None = None,
+        activities: list[str] | None = None,
+        limit: int = 20,
+    ) -> list[LocationShortDb]:
+        """
+        Locations with a name or search tag starting with the words of the
+        query, best matches first. Optionally restricted to a bbox or to
+        `radius` km around the center.
+        """
+        if self.search_index is None:
+            return await self._search_mongo(
+                query, bbox, center, radius, activities, limit
+            )
+
+        wanted = None if activities is None else set(activities)
+
+        def predicate(loc: LocationShortDb) -> bool:
+            long, lat = loc.location.coordinates
+            if bbox is not None and not any(
+                west <= long <= east and south <= lat <= north
+                for (west, south), (east, north) in split_antimeridian(bbox)
+            ):
+                return False
+            if center is not None and radius is not None:
+                if distance(center, (long, lat)) > radius * 1000:
+                    return False
+            return wanted is None or not wanted.isdisjoint(loc.activity_types)
+
+        return [loc for _, loc in self.search_index.search(query, predicate, limit)]
+
+    async def _search_mongo(
+        self,
+        query: str,
+        bbox: BoundingBox | None,
+        center: LongLat | None,
+        radius: float | None,
+        activities: list[str] | None,
+        limit: int,
+    ) -> list[LocationShortDb]:
+        """Fallback while the search index is built, only matches name prefixes."""
+        filters = [RegEx(LocationShortDb.name, f"^{re.escape(query.strip())}", "i")]
+        if bbox is not None:
+            filters.append(self._bbox_query(bbox, None).get_filter_query())
+        if center is not None and radius is not None:
+            filters.append(
+                {
+                    "location": {
+                        "$geoWithin": {
+                            "$centerSphere": [list(center), radius / EARTH_RADIUS_KM]
+                        }
+                    }
+                }
+            )
+
+        return await self._find(*filters, activities=activities, limit=limit).to_list()
+
     async def find_with_filters(
         self,
         *filters,
@@ -102,91 +1077,264 @@ class LocationService:
         limit: int | None = None,
         return_short=True,
     ) -> list[LocationDetailedDb] | list[LocationShortDb]:
+        return await self._find(
+            *filters, activities=activities, limit=limit, return_short=return_short
+        ).to_list()
+
+    def _find(
+        self,
+        *filters,
+        activities: list[str] | None,
+        limit: int | None = None,
+        return_short=True,
+    ) -> FindMany[LocationDetailedDb] | FindMany[LocationShortDb]:
         filters = list(filters)
         if activities is not None:
             filters.append(self.get_activities_filter(activities))
 
         if return_short:
-            return await LocationShortDb.find_many(*filters).limit(limit).to_list()
-
-        return await LocationDetailedDb.find_many(*filters).limit(limit).to_list()
+            return LocationShortDb.find_many(*filters).limit(limit)
+
+        return LocationDetailedDb.find_many(*filters).limit(limit)
+
+    async def check_possible_duplicate(
+        self, location: LocationBase
+    ) -> list[PossibleDuplicate]:
+        """
+        Existing locations within the duplicate radius that are similar enough
+        to the given one, most likely duplicates first.
+        """
+        candidates = LocationDetailedDb.get_motor_collection().aggregate(
+            [
+                {
+                    "$geoNear": {
+                        "near": location.location.dict(),
+                        "key": "location",
+                        "distanceField": "distance",
+                        "maxDistance": DUPLICATE_RADIUS,
+                        "spherical": True,
+                    }
+                },
+                {"$limit": MAX_DUPLICATE_CANDIDATES},
+                {"$project": {"name": 1, "activity_types": 1, "distance": 1}},
+            ]
+        )
 
-    def check_possible_duplicate(
-        self, location: LocationDetailed
-    ) -> None | list[LocationDetailed]:
-        return None
+        duplicates = []
+        async for c in candidates:
+            score = duplicate_score(
+                c["distance"],
+                location.activity_types,
+                c.get("activity_types", []),
+                location.name,
+                c.get("name"),
+            )
+            if score >= DUPLICATE_THRESHOLD:
+                duplicates.append(PossibleDuplicate(**to_api_doc(c), score=score))
+
+        duplicates.sort(key=lambda d: d.score, reverse=True)
+        return duplicates
+
+    async def iter_duplicate_pairs(
+        self, block_size: float = DUPLICATE_BLOCK_SIZE
+    ) -> AsyncIterator[tuple[dict[str, Any], dict[str, Any], float, float]]:
+        """
+        Yield all pairs of possible duplicates as (location, other, distance, score).
+
+        The world is partitioned into blocks of `block_size` degrees, which are
+        loaded one after another together with a margin of the duplicate radius,
+        so memory only depends on the most crowded block. A pair is reported by
+        the block of the location with the smaller id.
+        """
+        collection = LocationShortDb.get_motor_collection()
+        blocks = collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {
+                            "x": _block_of("$location.coordinates", 0, block_size),
+                            "y": _block_of("$location.coordinates", 1, block_size),
+                        }
+                    }
+                },
+                {"$sort": {"_id.x": 1, "_id.y": 1}},
+            ]
+        )
+        projection = {"name": 1, "activity_types": 1, "location.coordinates": 1}
+
+        async for block in blocks:
+            west, south = block["_id"]["x"] * block_size, block["_id"]["y"] * block_size
+            east, north = west + block_size, south + block_size
+            d_long, d_lat = radius_in_degrees(max(abs(south), abs(north)))
+            bbox = ((west - d_long, south - d_lat), (east + d_long, north + d_lat))
+
+            grid: GridIndex[dict[str, Any]] = GridIndex(cell_size=max(d_long, d_lat))
+            query = self._bbox_query(bbox, None).get_filter_query()
+            async for doc in collection.find(query, projection):
+                grid.insert(doc["_id"], *doc["location"]["coordinates"], doc)
+
+            for doc in grid.values():
+                long, lat = doc["location"]["coordinates"]
+                if not (west <= long < east and south <= lat < north):
+                    continue  # in the margin, handled by its own block
+
+                d_long, d_lat = radius_in_degrees(lat)
+                near = ((long - d_long, lat - d_lat), (long + d_long, lat + d_lat))
+                others = list(grid.query(near, lambda o: o["_id"] > doc["_id"]))
+                if not others:
+                    continue
+
+                dists = distances(
+                    (long, lat), [o["location"]["coordinates"] for o in others]
+                )
+                for other, dist in zip(others, dists.tolist()):
+                    score = duplicate_score(
+                        dist,
+                        doc.get("activity_types", []),
+                        other.get("activity_types", []),
+                        doc.get("name"),
+                        other.get("name"),
+                    )
+                    if score >= DUPLICATE_THRESHOLD:
+                        yield doc, other, dist, score
 
     async def update(self, user: User, history: LocationHistoryIn):
-        # TODO: Acquire a write lock, so between reading the location data
-        # and writing them there cant be another update...
-        loc = await LocationDetailedDb.get(history.location_id)
-        if not loc:
-            raise errors.LocationDoesNotExist()
-
+        """
+        Apply the changes with a single conditional update. It only matches if
+        the location still has the `before` data (and version, if given), so
+        concurrent updates are reported as conflict instead of overwritten.
+        """
         # TODO: determine if the user is eligible to update the location
 
-        history = LocationHistory(
-            user_id=user.id,
-            date=datetime.utcnow(),
-            **history.dict(),
+        query, changes = self._update(history)
+        now = datetime.utcnow()
+        changes.setdefault("$set", {})["last_modified"] = now
+        changes["$inc"] = {"version": 1}
+
+        doc = await LocationDetailedDb.get_motor_collection().find_one_and_update(
+            {"_id": history.location_id} | query,
+            changes,
+            projection=DETAILED_SHORT_PROJECTION | {"version": 1, "tags": 1},
+            return_document=ReturnDocument.AFTER,
         )
-        self._update(loc, history)
-        await loc.save()
+        if doc is None:
+            current = await LocationDetailedDb.get_motor_collection().find_one(
+                {"_id": history.location_id}, {"version": 1}
+            )
+            if current is None:
+                raise errors.LocationDoesNotExist()
+            raise errors.LocationUpdateConflict(current.get("version", 0))
+
+        short_changes = {
+            k: doc.get(k) for k in history.after or {} if k in SHORT_FIELDS
+        }
+        loc_short = parse_obj(LocationShortDb, to_short_doc(doc))
+        if short_changes:
+            # changes of tags and geometry don't touch the short version
+            if self._dual_write():
+                await LocationShortDb.get_motor_collection().update_one(
+                    {"_id": history.location_id}, {"$set": short_changes}
+                )
+            old_location = query.get("location")
+            self._location_changed(
+                loc_short, old_location and old_location["coordinates"]
+            )
 
-        # Update the short version
-        await LocationShortDb(**loc.dict()).save()
-        # loc_short = await LocationShortDb.get(location_id)
+        if "location" in short_changes or "activity_types" in short_changes:
+            await self._facets_changed(
+                (
+                    query.get("location", doc["location"])["coordinates"],
+                    query.get("activity_types", doc["activity_types"]),
+                ),
+                (doc["location"]["coordinates"], doc["activity_types"]),
+            )
+
+        if short_changes or history.tags:
+            self._search_entry_changed(loc_short, doc.get("tags", {}))
+
+        await LocationHistory(
+            user_id=user.id, date=now, **history.dict() | {"version": doc["version"]}
+        ).insert()
 
-        # TODO: add location history entry
-        await history.save()
+    def _update(
+        self, history: LocationHistoryIn
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        """
+        Translate the history entry to the query matching the `before` state and
+        the `$set`/`$unset` changes leading to the `after` state.
+        """
+        query: dict[str, Any] = {}
+        set_: dict[str, Any] = {}
+        unset: dict[str, Any] = {}
+
+        if history.version is not None:
+            # locations stored before versioning was introduced have no version
+            query["version"] = (
+                history.version if history.version else {"$in": [0, None]}
+            )
 
-    def _update(self, location: LocationDetailedDb, history: LocationHistory):
         if history.after is not None:
             if history.before is None:
                 raise errors.InvalidHistory()
 
             for k, v in history.after.items():
-                if k not in ["name", "geometry", "activity_type", "location"]:
+                if k not in UPDATABLE_FIELDS:
                     raise errors.InvalidUpdateType(k)
 
                 if k not in history.before:
                     raise errors.InvalidHistory()
 
-                v_old = history.before[k]
-
-                if v_old != location.__getattribute__(k):
-                    raise errors.InvalidBeforeData(k)
-
-                location.__setattr__(k, v)
+                query[k] = _field_value(k, history.before[k])
+                v = _field_value(k, v)
+                if v is None:
+                    unset[k] = ""
+                else:
+                    set_[k] = v
 
         if history.tags is not None:
-            tags = location.tags
             for t, change in history.tags.items():
+                if not t or t.startswith("$") or "." in t:
+                    raise errors.InvalidHistory()
+
+                key = f"tags.{t}"
                 match change.mode:
                     case TagChangeType.ADD:
-                        if t in tags:
-                            raise errors.TagExists()
-                        tags[t] = change.content
+                        query[key] = {"$exists": False}
+                        set_[key] = change.content
                     case TagChangeType.DELETE:
-                        if t not in tags:
-                            raise errors.TagDoesNotExist()
-
-                        if change.content != tags[t]:
-                            raise errors.InvalidBeforeData(f"tags:{t}")
-
-                        del tags[t]
+                        query[key] = change.content
+                        unset[key] = ""
                     case TagChangeType.CHANGE:
-                        if t not in tags:
-                            raise errors.TagDoesNotExist()
-
-                        if tags[t] != change.content[0]:
-                            raise errors.InvalidBeforeData(t)
-
-                        tags[t] = change.content[1]
-
-    async def get_history(self, location_id: PydanticObjectId, offset: int):
-        search = LocationHistory.find(LocationHistory.location_id == location_id)
-        return await search.sort(-LocationHistory.date).skip(offset).limit(10).to_list()
+                        if (
+                            not isinstance(change.content, list)
+                            or len(change.content) != 2
+                        ):
+                            raise errors.InvalidHistory()
+                        query[key] = change.content[0]
+                        set_[key] = change.content[1]
+
+        changes: dict[str, Any] = {}
+        if set_:
+            changes["$set"] = set_
+        if unset:
+            changes["$unset"] = unset
+        return query, changes
+
+    async def get_history(
+        self, location_id: PydanticObjectId, cursor: str | None, size: int
+    ) -> tuple[list[LocationHistory], str | None]:
+        """Newest changes first, returns the page and the cursor of the next one."""
+        filters = [LocationHistory.location_id == location_id]
+        if cursor is not None:
+            filters.append(keyset_filter("date", decode_cursor(cursor)))
+
+        search = LocationHistory.find(*filters)
+        history = await (
+            search.sort(-LocationHistory.date, -LocationHistory.id)
+            .limit(size + 1)
+            .to_list()
+        )
+        return page_of(history, size, lambda h: (h.date, h.id))
 
     async def report_update(self, user: User, update_id: PydanticObjectId, reason: str):
         c = await LocationUpdateReport.find(
@@ -220,11 +1368,16 @@ class LocationService:
         if user.id != photo.user_id:
             raise Exception("Profile photo does not belong to user!")
 
+        now = datetime.utcnow()
         if location.photos is None:
             location.photos = [photo]
+            location.last_modified = now
             await location.save()
         else:
-            await location.update(Push({LocationDetailedDb.photos: photo}))
+            await location.update(
+                Push({LocationDetailedDb.photos: photo}),
+                Set({LocationDetailedDb.last_modified: now}),
+            )
 
     async def get_photo_owner(self, location_id: PydanticObjectId, photo_url: str):
         loc: LocationDetailedDb = await self.get(location_id)
@@ -237,102 +1390,113 @@ class LocationService:
 
     async def remove_photo(self, location_id: PydanticObjectId, photo_url: str):
         loc: LocationDetailedDb = await self.get(location_id)
-        await loc.update(Pull({LocationDetailedDb.photos: Eq("url", photo_url)}))
-
-    async def add_review(self, location_id: PydanticObjectId, review: Review):
-        loc = await self.get(location_id)
-        if not loc:
-            raise errors.LocationDoesNotExist()
-
-        former_avg = loc.reviews.average_rating
-        cnt = loc.reviews.count
-
-        # TODO: is this accurate? Floating point inaccuracies might be a problem
-        new_avg = (former_avg * cnt + review.overall_rating) / (cnt + 1)
-
-        loc.reviews.average_rating = new_avg
-        loc.reviews.count += 1
-        loc = await loc.save()
-
-        print(len(loc.reviews.recent))
         await loc.update(
-            Push(
-                {
-                    LocationDetailedDb.reviews.recent: {
-                        "$position": 0,
-                        "$each": [ReviewWithId(**review.dict())],
-                    }
-                }
-            )
-        )  # push first
-        if len(loc.reviews.recent) == MAX_RECENT_REVIEWS:
-            loc = await loc.update(
-                Pop({LocationDetailedDb.reviews.recent: 1})
-            )  # pop last
-        print(len(loc.reviews.recent))
-
-        loc_short = await self.get_short(location_id)
-        if not loc_short:
-            raise errors.LocationDoesNotExist()
+            Pull({LocationDetailedDb.photos: Eq("url", photo_url)}),
+            Set({LocationDetailedDb.last_modified: datetime.utcnow()}),
+        )
 
-        loc_short.average_rating = new_avg
+    async def add_review(self, location_id: PydanticObjectId, review: Review):
+        recent = ReviewWithId(**review.dict()).dict()
+        await self._update_review_summary(
+            location_id,
+            {
+                "reviews.rating_sum": {"$add": [RATING_SUM, review.overall_rating]},
+                "reviews.count": {"$add": ["$reviews.count", 1]},
+                # push first, drop the oldest if there are too many
+                "reviews.recent": {
+                    "$slice": [
+                        {"$concatArrays": [{"$literal": [recent]}, "$reviews.recent"]},
+                        MAX_RECENT_REVIEWS,
+                    ]
+                },
+            },
+        )
 
     async def remove_review(self, location_id: PydanticObjectId, review: Review):
-        loc = await self.get(location_id)
-        if not loc:
-            raise errors.LocationDoesNotExist()
-
-        # adjust count and average
-        former_avg = loc.reviews.average_rating
-        cnt = loc.reviews.count
-
-        if cnt == 1:
-            new_avg = 0
-            loc.reviews.count = 0
-        else:
-            new_avg = (former_avg * cnt - review.overall_rating) / (cnt - 1)
-            loc.reviews.count -= 1
-
-        loc.reviews.average_rating = new_avg
-        loc = await loc.save()
-
-        # update short version
-        loc_short = await self.get_short(location_id)
-        if not loc_short:
-            raise errors.LocationDoesNotExist()
-
-        # remove from recent list if present
-        if review in loc.reviews.recent:
-            loc = await loc.update(
-                Pull({LocationDetailedDb.reviews.recent: Eq("id", review.id)})
-            )
-            # TODO: in this case add another recent Review to the list
+        await self._update_review_summary(
+            location_id,
+            {
+                "reviews.rating_sum": {
+                    "$subtract": [RATING_SUM, review.overall_rating]
+                },
+                "reviews.count": {"$max": [{"$subtract": ["$reviews.count", 1]}, 0]},
+                # remove from recent list if present
+                "reviews.recent": {
+                    "$filter": {
+                        "input": "$reviews.recent",
+                        "cond": {"$ne": ["$$this.id", review.id]},
+                    }
+                },
+            },
+        )
+        # TODO: in case it was a recent review, add another recent one to the list
 
     async def update_review(
         self, location_id: PydanticObjectId, updated_review: Review, old_rating: float
     ):
-        loc = await self.get(location_id)
-        if not loc:
-            raise errors.LocationDoesNotExist()
-
-        # adjust count and average
-        former_avg = loc.reviews.average_rating
-        cnt = loc.reviews.count
-
-        # add new rating and substract old rating from former average
-        new_avg = (former_avg * cnt + updated_review.overall_rating - old_rating) / cnt
+        new_review = ReviewWithId(**updated_review.dict()).dict()
+        await self._update_review_summary(
+            location_id,
+            {
+                # add new rating and substract old rating
+                "reviews.rating_sum": {
+                    "$add": [RATING_SUM, updated_review.overall_rating - old_rating]
+                },
+                # replace the review, if it is in the recent list
+                "reviews.recent": {
+                    "$map": {
+                        "input": "$reviews.recent",
+                        "in": {
+                            "$cond": [
+                                {"$eq": ["$$this.id", updated_review.id]},
+                                {"$literal": new_review},
+                                "$$this",
+                            ]
+                        },
+                    }
+                },
+            },
+        )
 
-        loc.reviews.average_rating = new_avg
+    async def _update_review_summary(
+        self, location_id: PydanticObjectId, changes: dict[str, Any]
+    ):
+        """
+        Apply the changes to the review summary and recompute the average rating
+        in a single atomic update, then copy the average to the short version
+        and the in-memory structures.
+        """
+        doc = await LocationDetailedDb.get_motor_collection().find_one_and_update(
+            {"_id": location_id},
+            [
+                {"$set": changes | {"last_modified": "$$NOW"}},
+                {
+                    "$set": {
+                        "reviews.rating_sum": {
+                            "$cond": [HAS_REVIEWS, "$reviews.rating_sum", 0]
+                        },
+                        "reviews.average_rating": {
+                            "$cond": [
+                                HAS_REVIEWS,
+                                {"$divide": ["$reviews.rating_sum", "$reviews.count"]},
+                                0,
+                            ]
+                        },
+                    }
+                },
+            ],
+            projection=DETAILED_SHORT_PROJECTION | SEARCH_TAGS_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            raise errors.LocationDoesNotExist()
 
-        new_review = ReviewWithId(**updated_review.dict())
+        if self._dual_write():
+            await LocationShortDb.get_motor_collection().update_one(
+                {"_id": location_id},
+                {"$set": {"average_rating": doc["reviews"]["average_rating"]}},
+            )
 
-        # check if the updated review was in the recent list
-        try:
-            r_ids = [r.id for r in loc.reviews.recent]
-            idx = r_ids.index(new_review.id)
-            loc.reviews.recent[idx] = new_review
-        except ValueError:
-            # If there is a ValueError, we ignore it, as it is expected
-            pass
-        finally:
-            await loc.save()
+        loc_short = parse_obj(LocationShortDb, to_short_doc(doc))
+        self._location_changed(loc_short)
+        self._search_entry_changed(loc_short, doc.get("tags", {}))
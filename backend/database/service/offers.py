@@ -1,23 +1,30 @@
+import asyncio
+import heapq
+import itertools
 import math
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Any
 
 from beanie import PydanticObjectId
 from beanie.odm.operators.find import BaseFindOperator
-from beanie.odm.operators.find.comparison import Eq, In
+from beanie.odm.operators.find.comparison import GTE, Eq, In
 from beanie.odm.queries.aggregation import AggregationQuery
-from beanie.operators import ElemMatch, Near, Push
-from geopy import distance as geo_distance
+from beanie.odm.utils.parsing import parse_obj
+from beanie.operators import Or
 
 from backend.database.models.locations import LocationDetailedDb, LocationShortDb
 from backend.database.models.offers import (
+    MINUTES_PER_DAY,
     LocationBlurrOut,
     Offer,
     OfferCreatorInfo,
     OfferIn,
     OfferLocationConnected,
+    OfferOut,
     OfferStatus,
     OfferTime,
+    OfferTimeRecurring,
     OfferType,
     OfferVisibility,
     Participant,
@@ -25,9 +32,90 @@ from backend.database.models.offers import (
 )
 from backend.database.models.shared import GeoJsonLocation
 from backend.database.models.users import User
-from backend.util import errors
+from backend.util import constants, errors
+from backend.util.pagination import decode_cursor, keyset_filter, page_of
+from backend.util.serialization import projection_for, to_api_doc
 from backend.util.types import LongLat, TimeSlotFixed
 
+OFFER_API_PROJECTION = projection_for(OfferOut)
+# the order of a user's offers, served by the participants index per status
+USER_OFFERS_SORT = [("creation_date", -1), ("_id", -1)]
+
+# participants taking up a place of an offer
+TAKING_PART = [ParticipantStatus.HOST.value, ParticipantStatus.ACCEPTED.value]
+# The offer has a place left, evaluated by mongo in the conditional updates.
+# The largest participant limit is the maximum, without limits there is none.
+HAS_FREE_PLACE = {
+    "$expr": {
+        "$or": [
+            {"$eq": [{"$size": "$participant_limits"}, 0]},
+            {
+                "$lt": [
+                    {
+                        "$size": {
+                            "$filter": {
+                                "input": "$participants",
+                                "cond": {"$in": ["$$this.status", TAKING_PART]},
+                            }
+                        }
+                    },
+                    {"$max": "$participant_limits"},
+                ]
+            },
+        ]
+    }
+}
+# conditional participant updates are retried this often while the offer keeps
+# changing in between, e.g. under many concurrent requests
+MAX_PARTICIPATION_ATTEMPTS = 5
+PARTICIPATION_PROJECTION = {
+    "status": 1,
+    "user_info.id": 1,
+    "participants": 1,
+    "participant_limits": 1,
+}
+
+
+def _midnight(dt: datetime) -> datetime:
+    return datetime.combine(dt.date(), datetime.min.time())
+
+
+def _minute_of(dt: datetime) -> float:
+    return dt.hour * 60 + dt.minute + dt.second / 60
+
+
+def window_days(start: datetime, end: datetime) -> list[tuple[datetime, float, float]]:
+    """
+    The days a search window touches, as (midnight, first minute, last minute)
+    of the part of the window on that day. Of the whole days in between, only
+    the first of every weekday is kept: a recurrence occurring on a later one
+    occurs on the first one as well.
+    """
+    first, last = _midnight(start), _midnight(end)
+    if first == last:
+        return [(first, _minute_of(start), _minute_of(end))]
+
+    days = [(first, _minute_of(start), MINUTES_PER_DAY)]
+    day = first + timedelta(days=1)
+    while day < last and day < first + timedelta(days=8):
+        days.append((day, 0, MINUTES_PER_DAY))
+        day += timedelta(days=1)
+
+    days.append((last, 0, _minute_of(end)))
+    return days
+
+
+def recurring_overlaps(time: OfferTimeRecurring, start: datetime, end: datetime):
+    """Whether an occurrence of the recurring time overlaps the window."""
+    until = _midnight(time.recurrence.until)
+    return any(
+        time.recurrence.weekdays & (1 << day.weekday())
+        and time.start_minute <= last
+        and first <= time.end_minute
+        and day <= until
+        for day, first, last in window_days(start, end)
+    )
+
 
 class TimesMatcher:
     def match(self, lhs: OfferTime, rhs: OfferTime):
@@ -38,13 +126,37 @@ class TimesMatcher:
         if lhs.type == OfferType.SINGLE and rhs.type == OfferType.SINGLE:
             return self._one_to_one(lhs.times, rhs.times)
 
-        # Should not happen...
-        return False
+        if lhs.type == OfferType.RECURRING and rhs.type == OfferType.RECURRING:
+            return self._weekly(lhs, rhs)
+
+        if lhs.type == OfferType.RECURRING:
+            return recurring_overlaps(lhs, *rhs.times)
+
+        return recurring_overlaps(rhs, *lhs.times)
 
     def _one_to_one(self, time1: TimeSlotFixed, time2: TimeSlotFixed):
         s1, e1, s2, e2 = [*time1, *time2]
         return s1 <= s2 <= e1 or s2 <= s1 <= e2
 
+    def _weekly(self, time1: OfferTimeRecurring, time2: OfferTimeRecurring):
+        """Shared weekdays and overlapping slots, ignoring when they start."""
+        return bool(
+            time1.recurrence.weekdays & time2.recurrence.weekdays
+            and time1.start_minute <= time2.end_minute
+            and time2.start_minute <= time1.end_minute
+        )
+
+
+def expiry_of(time: OfferTime) -> datetime | None:
+    """When an offer with the time is over, None if it doesn't end."""
+    if time.type == OfferType.SINGLE:
+        return time.times[1]
+
+    if time.type == OfferType.RECURRING:
+        return _midnight(time.recurrence.until) + timedelta(minutes=time.end_minute)
+
+    return None
+
 
 def blurr_center(center: GeoJsonLocation, radius: float):
     radius_meters = radius * 1000
@@ -65,9 +177,40 @@ def blurr_center(center: GeoJsonLocation, radius: float):
     )
 
 
-class OfferService:
-    tm = TimesMatcher()
+def time_filter(time: OfferTime | None) -> dict[str, Any] | None:
+    """
+    Filter for offers overlapping the search window, i.e. `s1 <= e2 and s2 <= e1`
+    for single offers. Recurring offers match if they occur on a day of the
+    window, before their `until`, with a slot overlapping the window on that
+    day. Flexible offers always match, None if every offer matches.
+    """
+    if time is None or time.type == OfferType.FLEXIBLE:
+        return None
+
+    if time.type == OfferType.RECURRING:
+        raise ValueError("Searching with a recurring time is not supported")
+
+    start, end = time.times
+    clauses: list[dict[str, Any]] = [
+        {"time.type": OfferType.FLEXIBLE.value},
+        {"time.start": {"$lte": end}, "time.end": {"$gte": start}},
+    ]
+    for day, first, last in window_days(start, end):
+        clause = {
+            "time.type": OfferType.RECURRING.value,
+            "time.recurrence.weekdays": {"$bitsAnySet": 1 << day.weekday()},
+            "time.recurrence.until": {"$gte": day},
+        }
+        if first > 0:
+            clause["time.end_minute"] = {"$gte": first}
+        if last < MINUTES_PER_DAY:
+            clause["time.start_minute"] = {"$lte": last}
+        clauses.append(clause)
+
+    return {"$or": clauses}
+
 
+class OfferService:
     async def create(self, user: User, offer: OfferIn) -> Offer:
         # TODO: check if user is eligible to create an offer.
 
@@ -93,46 +236,40 @@ class OfferService:
             status=OfferStatus.OPEN,
             participants=participants,
             blurr_info=blurr,
+            expires_at=expiry_of(offer.time),
             **offer.dict(),
         ).insert()
 
         return new_offer
 
-    async def _check_and_set_timeout(self, offers) -> list[Offer]:
-        now = datetime.utcnow()
-
-        filtered_offers = []
-        for offer in offers:
-            # TODO: handle timeout case with recurrence
-            if offer.time.type == OfferType.SINGLE and offer.time.times[1] < now:
-                offer.status = OfferStatus.TIMEOUT
-                await offer.save()
-
-            if offer.status == OfferStatus.TIMEOUT:
-                continue
-
-            filtered_offers.append(offer)
-
-        return filtered_offers
+    def _visible_filters(
+        self, user: User, time: OfferTime | None = None
+    ) -> list[BaseFindOperator | dict[str, Any]]:
+        """
+        Filters for the offers of others the user may see, overlapping the time.
+        Offers are timed out by the expiry sweeper, until then expired ones are
+        excluded here.
+        """
+        filters = [
+            Eq(Offer.status, OfferStatus.OPEN),
+            Eq(Offer.visibility, OfferVisibility.PUBLIC),
+            Offer.user_info.id != user.id,
+            Or(Eq(Offer.expires_at, None), GTE(Offer.expires_at, datetime.utcnow())),
+        ]
 
-    def _filter_date_time(
-        self, offers: list[Offer], date_time: OfferTime | None
-    ) -> list[Offer]:
-        if not date_time or date_time.type == OfferType.FLEXIBLE:
-            return offers
+        overlap = time_filter(time)
+        if overlap is not None:
+            filters.append(overlap)
 
-        return [offer for offer in offers if self.tm.match(offer.time, date_time)]
+        return filters
 
     async def _get_with_filters(
-        self, user: User, filters: list[BaseFindOperator]
+        self,
+        user: User,
+        filters: list[BaseFindOperator],
+        time: OfferTime | None = None,
     ) -> list[Offer]:
-        filters.extend(
-            [
-                Eq(Offer.status, OfferStatus.OPEN),
-                Eq(Offer.visibility, OfferVisibility.PUBLIC),
-                Offer.user_info.id != user.id,
-            ]
-        )
+        filters.extend(self._visible_filters(user, time))
 
         # TODO: imeplement users ignoring eachother's offers
         # ignored = []  # user.ignored
@@ -146,10 +283,7 @@ class OfferService:
         # Or(Eq(Offer.visibility, OfferVisibility.PUBLIC),
         # And(Eq(Offer.visibility, OfferVisibility.FRIENDS))),
 
-        offers = await Offer.find_many(*filters).to_list()
-        offers = await self._check_and_set_timeout(offers)
-
-        return offers
+        return await Offer.find_many(*filters).to_list()
 
     async def get(self, id: PydanticObjectId) -> Offer | None:
         return await Offer.get(id)
@@ -159,10 +293,110 @@ class OfferService:
 
         return offers
 
-    async def get_for_user(self, user: User):
-        return await Offer.find(
-            ElemMatch(Offer.participants, {"id": user.id})
-        ).to_list()
+    async def get_bulk_raw(self, ids: list[PydanticObjectId]) -> list[dict[str, Any]]:
+        """
+        Like `get_bulk`, but returns raw documents in the shape of `OfferOut`,
+        without validating them into models.
+        """
+        return await self._find_raw(In(Offer.id, ids))
+
+    async def get_for_user(
+        self,
+        user: User,
+        statuses: list[OfferStatus] | None = None,
+        time: OfferTime | None = None,
+        cursor: str | None = None,
+        size: int = constants.OFFERS_PAGE_SIZE,
+    ) -> tuple[list[Offer], str | None]:
+        """
+        Offers the user hosts or participates in, newest first, optionally only
+        with the statuses and overlapping the time. Returns the page and the
+        cursor of the next one.
+        """
+        docs = await self._find_for_user(user, statuses, time, cursor, size)
+        offers = [parse_obj(Offer, doc) for doc in docs]
+        return page_of(offers, size, lambda o: (o.creation_date, o.id))
+
+    async def get_for_user_raw(
+        self,
+        user: User,
+        statuses: list[OfferStatus] | None = None,
+        time: OfferTime | None = None,
+        cursor: str | None = None,
+        size: int = constants.OFFERS_PAGE_SIZE,
+    ) -> tuple[list[dict[str, Any]], str | None]:
+        """Like `get_for_user`, but returns raw documents like `get_bulk_raw`."""
+        docs = await self._find_for_user(
+            user, statuses, time, cursor, size, OFFER_API_PROJECTION
+        )
+        page, next_cursor = page_of(
+            docs, size, lambda doc: (doc["creation_date"], doc["_id"])
+        )
+        return [to_api_doc(doc) for doc in page], next_cursor
+
+    async def _find_for_user(
+        self,
+        user: User,
+        statuses: list[OfferStatus] | None,
+        time: OfferTime | None,
+        cursor: str | None,
+        size: int,
+        projection: dict[str, Any] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        The first `size + 1` offers of the user, newest first. Every status is
+        read with its own query, which the participants index returns already
+        sorted, and the results are merged; a single query over several
+        statuses would have to be sorted in memory.
+        """
+        collection = Offer.get_motor_collection()
+        queries = [
+            Offer.find(
+                *self._user_filters(user, status, time, cursor)
+            ).get_filter_query()
+            for status in dict.fromkeys(statuses or OfferStatus)
+        ]
+        results = await asyncio.gather(
+            *(
+                collection.find(query, projection)
+                .sort(USER_OFFERS_SORT)
+                .limit(size + 1)
+                .to_list(None)
+                for query in queries
+            )
+        )
+        merged = heapq.merge(
+            *results,
+            key=lambda doc: (doc["creation_date"], doc["_id"]),
+            reverse=True,
+        )
+        return list(itertools.islice(merged, size + 1))
+
+    def _user_filters(
+        self,
+        user: User,
+        status: OfferStatus,
+        time: OfferTime | None,
+        cursor: str | None,
+    ) -> list[BaseFindOperator | dict[str, Any]]:
+        filters: list[BaseFindOperator | dict[str, Any]] = [
+            {"participants.id": user.id},
+            Eq(Offer.status, status),
+        ]
+
+        overlap = time_filter(time)
+        if overlap is not None:
+            filters.append(overlap)
+
+        if cursor is not None:
+            filters.append(keyset_filter("creation_date", decode_cursor(cursor)))
+
+        return filters
+
+    async def _find_raw(self, *filters) -> list[dict[str, Any]]:
+        query = Offer.find(*filters).get_filter_query()
+        cursor = Offer.get_motor_collection().find(query, OFFER_API_PROJECTION)
+        return [to_api_doc(doc) async for doc in cursor]
 
     async def get_at_location(
         self, user: User, location_id: PydanticObjectId, date_time: OfferTime
@@ -175,9 +409,7 @@ class OfferService:
             Eq(Offer.location.id, location_id),
         ]
 
-        offers = await self._get_with_filters(user, filters)
-
-        return self._filter_date_time(offers, date_time)
+        return await self._get_with_filters(user, filters, date_time)
 
     async def get_around(
         self,
@@ -186,29 +418,69 @@ class OfferService:
         distance: float,  # in km
         time: OfferTime,
         activities: list[str] | None,
-    ) -> list[Offer]:
-        filters: list[BaseFindOperator] = [
-            # use this: when beanie/#674 is fixed!
-            # Near(Offer.blurr_info.center, *center, max_distance=distance * 1000),
-            Near("blurr_info.center", *center, max_distance=distance * 1000),
-        ]
-
-        if activities:
-            filters.append(In(Offer.activity, activities))
+    ) -> list[tuple[Offer, float]]:
+        """
+        Offers within `distance` km that are visible from the center, i.e. their
+        visibility radius plus the blurr radius reaches it, with their distance
+        in km. Nearest first.
+        """
+        cursor = Offer.get_motor_collection().aggregate(
+            self._around_pipeline(user, center, distance, time, activities)
+        )
 
-        offers = await self._get_with_filters(user, filters)
+        distances = {}
+        offers = []
+        async for doc in cursor:
+            distances[doc["_id"]] = doc.pop("distance") / 1000
+            offers.append(parse_obj(Offer, doc))
 
-        # TODO: filter out offers with too low visibility radius
-        # maybe as in https://stackoverflow.com/questions/28659081/mongodb-near-geonear-with-the-maxdistance-value-from-database
-        result = []
-        for offer in offers:
-            dist = geo_distance.distance(offer.blurr_info.center.coordinates, center).km
-            if offer.visibility_radius + offer.blurr_info.radius < dist:
-                continue
+        return [(offer, distances[offer.id]) for offer in offers]
 
-            result.append(offer)
+    def _around_pipeline(
+        self,
+        user: User,
+        center: LongLat,
+        distance: float,
+        time: OfferTime,
+        activities: list[str] | None,
+    ) -> list[dict[str, Any]]:
+        filters = self._visible_filters(user, time)
+        if activities:
+            filters.append(In(Offer.activity, activities))
 
-        return self._filter_date_time(result, time)
+        return [
+            {
+                "$geoNear": {
+                    "near": {"type": "Point", "coordinates": list(center)},
+                    "key": "blurr_info.center",
+                    "distanceField": "distance",
+                    "maxDistance": distance * 1000,
+                    "spherical": True,
+                    "query": Offer.find(*filters).get_filter_query(),
+                }
+            },
+            # the distance is in meters, the radii in km
+            {
+                "$match": {
+                    "$expr": {
+                        "$lte": [
+                            "$distance",
+                            {
+                                "$multiply": [
+                                    {
+                                        "$add": [
+                                            "$visibility_radius",
+                                            "$blurr_info.radius",
+                                        ]
+                                    },
+                                    1000,
+                                ]
+                            },
+                        ]
+                    }
+                }
+            },
+        ]
 
     async def _get_offer_with_checks(
         self, user: User, offer_id: PydanticObjectId
@@ -242,20 +514,31 @@ class OfferService:
     async def request_to_join(
         self, user: User, offer_id: PydanticObjectId, message: str
     ):
-        offer = await self.get(offer_id)
-
-        if offer is None:
-            raise errors.UserAlreadyRequestedToJoin()
-
-        await offer.update(
-            Push(
+        """
+        Add the user as requesting participant, with a single conditional
+        update, so concurrent requests can't overwrite each other.
+        """
+        participant = {"id": user.id, "status": ParticipantStatus.REQUESTED.value}
+        for _ in range(MAX_PARTICIPATION_ATTEMPTS):
+            result = await Offer.get_motor_collection().update_one(
                 {
-                    Offer.participants: Participant(
-                        id=user.id, status=ParticipantStatus.REQUESTED
-                    )
+                    "_id": offer_id,
+                    "status": OfferStatus.OPEN.value,
+                    "participants.id": {"$ne": user.id},
                 }
+                | HAS_FREE_PLACE,
+                {"$push": {"participants": participant}},
             )
-        )
+            if result.matched_count > 0:
+                break
+
+            offer = await self._get_participation(offer_id)
+            if any(p["id"] == user.id for p in offer["participants"]):
+                raise errors.UserAlreadyRequestedToJoin()
+            self._raise_if_closed_or_full(offer)
+            # the offer changed in between and allows the request now
+        else:
+            raise errors.OfferUpdateConflict()
 
         # TODO: send push notification to host with message
 
@@ -286,22 +569,62 @@ class OfferService:
         participant_id: PydanticObjectId,
         status: ParticipantStatus,
     ):
-        offer = await self.get(offer_id)
-        if not offer:
+        """
+        Change the status with a single conditional update of the matching
+        array element. Accepting only matches while the offer has a place left.
+        """
+        query = {
+            "_id": offer_id,
+            "user_info.id": host.id,
+            "participants": {
+                "$elemMatch": {"id": participant_id, "status": {"$ne": status.value}}
+            },
+        }
+        if status == ParticipantStatus.ACCEPTED:
+            query |= {"status": OfferStatus.OPEN.value} | HAS_FREE_PLACE
+
+        for _ in range(MAX_PARTICIPATION_ATTEMPTS):
+            result = await Offer.get_motor_collection().update_one(
+                query,
+                # `$` is the participant matched by the $elemMatch
+                {"$set": {"participants.$.status": status.value}},
+            )
+            if result.matched_count > 0:
+                return
+
+            offer = await self._get_participation(offer_id)
+            if offer["user_info"]["id"] != host.id:
+                raise errors.UserDoesNotOwnOffer()
+
+            for p in offer["participants"]:
+                if p["id"] == participant_id:
+                    if p["status"] == status.value:
+                        raise errors.ParticipantStatusUnchanged()
+                    break
+            else:
+                raise errors.UserIsNotParticipant()
+
+            if status == ParticipantStatus.ACCEPTED:
+                self._raise_if_closed_or_full(offer)
+            # the offer changed in between and allows the update now
+
+        raise errors.OfferUpdateConflict()
+
+    async def _get_participation(self, offer_id: PydanticObjectId) -> dict[str, Any]:
+        """The fields a participant update depends on, to tell why it failed."""
+        offer = await Offer.get_motor_collection().find_one(
+            {"_id": offer_id}, PARTICIPATION_PROJECTION
+        )
+        if offer is None:
             raise errors.OfferDoesNotExist()
 
-        if offer.user_info.id != host.id:
-            raise errors.UserDoesNotOwnOffer()
-
-        for p in offer.participants:
-            if p.id != participant_id:
-                continue
+        return offer
 
-            if p.status == status:
-                raise errors.ParticipantStatusUnchanged()
+    def _raise_if_closed_or_full(self, offer: dict[str, Any]):
+        if offer["status"] != OfferStatus.OPEN.value:
+            raise errors.OfferIsNotOpen()
 
-            p.status = status
-            await offer.save()
-            break
-        else:
-            raise errors.UserIsNotParticipant()
+        limits = offer["participant_limits"]
+        taking_part = [p for p in offer["participants"] if p["status"] in TAKING_PART]
+        if limits and len(taking_part) >= max(limits):
+            raise errors.OfferIsFull()
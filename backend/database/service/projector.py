@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime
+from typing import Any
+
+from beanie import PydanticObjectId
+from beanie.odm.utils.parsing import parse_obj
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+from backend.database.models.locations import (
+    LocationDetailedDb,
+    LocationProjectionState,
+    LocationShortDb,
+)
+from backend.database.service.locations import (
+    DETAILED_SHORT_PROJECTION,
+    LocationService,
+    to_short_doc,
+)
+
+STATE_ID = "simple_locations"
+BACKFILL_BATCH_SIZE = 1000
+# seconds to wait before reconnecting after the stream broke, doubled after
+# every failure in a row up to the maximum
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+# the stored resume token is too old or otherwise not usable anymore
+RESUME_TOKEN_ERRORS = [
+    260,  # InvalidResumeToken
+    280,  # ChangeStreamFatalError
+    286,  # ChangeStreamHistoryLost
+]
+
+WATCHED_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+
+class LocationProjector:
+    """
+    Keeps `simple_locations` in sync by following the change stream of
+    `locations`. The resume token is stored after every change, so a restarted
+    projector continues where it stopped. Without a usable token, the short
+    collection is rebuilt with `backfill` first.
+    """
+
+    def __init__(self, location_service: LocationService) -> None:
+        self.location_service = location_service
+        self._task: asyncio.Task | None = None
+        self._retry_delay = RETRY_DELAY
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self):
+        # Never give up: the request handlers don't write the short locations
+        # themselves in this mode, they would silently stop being synced.
+        reset = False
+        while True:
+            try:
+                if reset:
+                    await self._save_token(None)
+                    reset = False
+                await self._follow()
+                continue
+            except OperationFailure as e:
+                if e.code in RESUME_TOKEN_ERRORS:
+                    print(f"Resume token not usable ({e}), rebuilding short locations")
+                    reset = True
+                    continue
+                print(f"Location change stream failed: {e}")
+            except PyMongoError as e:
+                print(f"Location change stream interrupted: {e}")
+            except Exception as e:
+                print(f"Location projector failed: {e!r}")
+
+            print(f"Restarting the location change stream in {self._retry_delay}s")
+            await asyncio.sleep(self._retry_delay)
+            self._retry_delay = min(self._retry_delay * 2, MAX_RETRY_DELAY)
+
+    async def _follow(self):
+        state = await LocationProjectionState.get(STATE_ID)
+        token = state.resume_token if state else None
+
+        async with LocationDetailedDb.get_motor_collection().watch(
+            [{"$match": {"operationType": {"$in": WATCHED_OPERATIONS}}}],
+            full_document="updateLookup",
+            resume_after=token,
+        ) as stream:
+            if token is None:
+                # The stream is already open, so changes during the backfill
+                # are not lost. Replaying them afterwards is harmless.
+                await self.backfill()
+                await self._save_token(stream.resume_token)
+
+            async for change in stream:
+                await self.apply(change)
+                await self._save_token(stream.resume_token)
+                self._retry_delay = RETRY_DELAY
+
+    async def _save_token(self, token: dict[str, Any] | None):
+        await LocationProjectionState(
+            id=STATE_ID, resume_token=token, updated=datetime.utcnow()
+        ).save()
+
+    async def apply(self, change: dict[str, Any]):
+        id: PydanticObjectId = change["documentKey"]["_id"]
+        short = LocationShortDb.get_motor_collection()
+
+        doc = change.get("fullDocument")
+        if change["operationType"] == "delete" or doc is None:
+            # with an update, `doc` is None if the location was deleted meanwhile
+            old = await short.find_one_and_delete(
+                {"_id": id}, projection={"location.coordinates": 1, "activity_types": 1}
+            )
+            self.location_service._location_removed(id)
+            if old is not None:
+                # inserts and updates are counted by the service, deletes only
+                # show up here
+                await self.location_service._facets_changed(
+                    (old["location"]["coordinates"], old.get("activity_types", [])),
+                    None,
+                )
+            return
+
+        short_doc = to_short_doc(doc)
+        old = await short.find_one_and_replace(
+            {"_id": id},
+            short_doc,
+            projection={"location.coordinates": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        loc_short = parse_obj(LocationShortDb, short_doc)
+        # a moved location also leaves its old tile and grid cell stale
+        old_coordinates = old["location"]["coordinates"] if old else None
+        self.location_service._location_changed(loc_short, old_coordinates)
+        self.location_service._search_entry_changed(loc_short, doc.get("tags", {}))
+
+    async def backfill(self, reset: bool = False, batch_size=BACKFILL_BATCH_SIZE):
+        """
+        Write the short version of every location. With `reset`, the short
+        collection is emptied first, which also removes stale entries.
+        """
+        short = LocationShortDb.get_motor_collection()
+        if reset:
+            await short.delete_many({})
+
+        count = 0
+        batch = []
+        cursor = LocationDetailedDb.get_motor_collection().find(
+            {}, DETAILED_SHORT_PROJECTION, batch_size=batch_size
+        )
+        async for doc in cursor:
+            short_doc = to_short_doc(doc)
+            batch.append(ReplaceOne({"_id": short_doc["_id"]}, short_doc, upsert=True))
+            if len(batch) >= batch_size:
+                await short.bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            await short.bulk_write(batch, ordered=False)
+            count += len(batch)
+
+        print(f"Backfilled {count} short locations")
+        return count
@@ -9,7 +9,9 @@ from backend.util import errors
 
 
 class ReviewService:
-    location_service = LocationService()
+    def __init__(self, location_service: LocationService) -> None:
+        # the shared instance, its in-memory structures see the rating changes
+        self.location_service = location_service
 
     async def get(self, id: PydanticObjectId):
         return await Review.get(id)
@@ -25,6 +27,22 @@ class ReviewService:
             return rs, None
         return rs, offset + size
 
+    async def get_page_version(
+        self, location_id: PydanticObjectId, offset: int, size: int
+    ) -> list[datetime]:
+        """
+        Creation dates of the reviews on a page, which is enough to tell if the
+        page has changed. Needs only the index, not the review documents, so
+        the `_id` is left out.
+        """
+        cursor = (
+            Review.get_motor_collection()
+            .find({"location_id": location_id}, {"creation_date": 1, "_id": 0})
+            .skip(offset)
+            .limit(size)
+        )
+        return [doc["creation_date"] async for doc in cursor]
+
     def validate(self, review_info: ReviewBase):
         # TODO: implement this!
         # - text is valid and not too long
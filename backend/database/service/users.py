@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 from typing import Any
 
 from beanie import PydanticObjectId
-from beanie.odm.queries.find import FindMany
+from beanie.odm.queries.find import FindMany, FindOne
 from beanie.operators import All, ElemMatch, In, RegEx, Unset
 
 import backend.util.errors as E
@@ -58,19 +58,40 @@ class UserService:
     async def get_bulk_by_id(self, ids: list[PydanticObjectId]) -> list[User]:
         return await User.find_many(In(User.id, ids)).to_list()
 
+    async def get_versions(
+        self, ids: list[PydanticObjectId]
+    ) -> dict[PydanticObjectId, datetime]:
+        """Fetch only the dates of the last changes to the users' public info."""
+        cursor = User.get_motor_collection().find(
+            {"_id": {"$in": ids}}, {"creation_date": 1, "last_modified": 1}
+        )
+        return {
+            doc["_id"]: doc.get("last_modified") or doc["creation_date"]
+            async for doc in cursor
+        }
+
     async def get_by_username(self, username: str) -> User | None:
-        u = await User.find_one(User.username == username)
+        u = await self.by_username_query(username)
         return u
 
+    def by_username_query(self, username: str) -> FindOne[User]:
+        return User.find_one(User.username == username)
+
     async def get_by_email(self, email: str) -> User | None:
-        u = await User.find_one(User.authentication.email == email)
+        u = await self.by_email_query(email)
         return u
 
+    def by_email_query(self, email: str) -> FindOne[User]:
+        return User.find_one(User.authentication.email == email)
+
     async def find_by_name(self, name):
+        users = await self.by_name_query(name).to_list()
+        return users
+
+    def by_name_query(self, name: str) -> FindMany[User]:
         # TODO: Check if this can be exploited! (like some injection, idk)
         regex = "^" + name  # only search from start of username
-        users = await User.find_many(RegEx(User.username, regex, options="i")).to_list()
-        return users
+        return User.find_many(RegEx(User.username, regex, options="i"))
 
     async def create_user(self, user_info: UserApiIn) -> NewUser:
         u = await self.get_by_username(user_info.username)
@@ -247,6 +268,7 @@ class UserService:
         for k, v in change_set.items():
             await _do(k, v)
 
+        user.last_modified = datetime.utcnow()
         await user.save()
         return user
 
@@ -255,11 +277,13 @@ class UserService:
             raise Exception("Profile photo does not belong to user!")
 
         user.avatar = photo_info
+        user.last_modified = datetime.utcnow()
 
         await user.save()
 
     async def delete_photo(self, user: User):
         user.avatar = None
+        user.last_modified = datetime.utcnow()
         await user.save()
 
     async def report_avatar(self, reporter: User, reported: User):
@@ -274,7 +298,7 @@ class RelationService:
             # TODO: Send a request
             pass
 
-        f = await UserRelation.find_one(All(UserRelation.users, ids))
+        f = await self.between_query(ids)
         if f is None:
             f = await self._create(ids, RelationStatus.PENDING)
             send_request()
@@ -407,9 +431,12 @@ class RelationService:
     async def has_relation_to(
         self, user_id_1: PydanticObjectId, user_id_2: PydanticObjectId
     ) -> UserRelation | None:
-        f = await UserRelation.find_one(All(UserRelation.users, [user_id_1, user_id_2]))
+        f = await self.between_query([user_id_1, user_id_2])
         return f
 
+    def between_query(self, ids: list[PydanticObjectId]) -> FindOne[UserRelation]:
+        return UserRelation.find_one(All(UserRelation.users, ids))
+
     async def _create(self, ids, status):
         r = await UserRelation(
             users=ids,
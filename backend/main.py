@@ -5,7 +5,9 @@ from fastapi.openapi.utils import get_openapi
 from fastapi.routing import APIRoute
 
 from .database.connection import init as init_db
+from .database.service import location_projector, location_service, offer_expiry_sweeper
 from .routers import admin, auth, chats, locations, offers, users
+from .util import constants
 from .util.email import setup_email_server_connection
 
 app = FastAPI()
@@ -23,6 +25,22 @@ app.add_middleware(
 async def startup():
     await init_db()
 
+    if constants.LOCATION_QUERY_ENGINE == constants.LOCATION_ENGINE_MEMORY:
+        # build in the background, bbox queries use mongo until it is done
+        location_service.start_index_build()
+
+    location_service.start_facet_cells_check()
+
+    if constants.LOCATION_SEARCH_INDEX:
+        location_service.start_search_index_build()
+
+    if constants.SHORT_LOCATION_SYNC == constants.SHORT_SYNC_CHANGE_STREAM:
+        location_projector.start()
+
+    offer_expiry_sweeper.start_backfill()
+    if constants.OFFER_EXPIRY_INTERVAL > 0:
+        offer_expiry_sweeper.start()
+
     app.include_router(admin.router)
     app.include_router(auth.router)
     app.include_router(locations.router)
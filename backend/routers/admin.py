@@ -1,9 +1,10 @@
-from typing import Annotated
+from typing import Annotated, Any
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Depends
 
 from backend.database.models.users import User
+from backend.database.service import location_service, offer_expiry_sweeper
 from backend.routers.auth import get_admin
 
 Admin = Annotated[User, Depends(get_admin)]
@@ -14,3 +15,13 @@ router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(get_ad
 @router.put("/locations/revert-update/{update_id}")
 async def revert_location_update(admin: Admin, update_id: PydanticObjectId):
     pass
+
+
+@router.get("/stats/bbox-cache")
+async def get_bbox_cache_stats(admin: Admin) -> dict[str, int]:
+    return location_service.bbox_cache.stats()
+
+
+@router.get("/stats/offer-expiry")
+async def get_offer_expiry_stats(admin: Admin) -> dict[str, Any]:
+    return offer_expiry_sweeper.stats()
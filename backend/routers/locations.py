@@ -1,30 +1,62 @@
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, AsyncIterator
 
 from beanie import PydanticObjectId
-from fastapi import APIRouter, Body, HTTPException, Query
+from fastapi import APIRouter, Body, HTTPException, Path, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 import backend.util.errors as errors
 from backend.database.models.locations import (
+    LocationBulkApi,
+    LocationCluster,
+    LocationClustersApi,
     LocationDetailed,
     LocationDetailedApi,
+    LocationFacetsApi,
     LocationHistoryIn,
+    LocationHistoryPage,
     LocationNew,
     LocationShortApi,
     LocationShortDb,
+    PossibleDuplicate,
     ReviewBase,
     ReviewsPage,
     ReviewsSummary,
     ReviewWithId,
 )
-from backend.database.models.shared import PhotoInfo, PhotoUrl
+from backend.database.models.shared import GeoJsonLocation, PhotoInfo, PhotoUrl
 from backend.database.service import location_service, review_service, user_service
 from backend.routers.auth import ApiUser
+from backend.util import constants, tiles
+from backend.util.conditional import (
+    cache_headers,
+    is_conditional,
+    is_not_modified,
+    make_etag,
+    not_modified,
+)
+from backend.util.serialization import RawJsonResponse
 from backend.util.types import LatitudeCoordinate, LongitudeCoordinate
 
 router = APIRouter(prefix="/locations", tags=["locations"])
 
+# seconds that clients and proxies may reuse a location tile
+TILE_MAX_AGE = 60 * 60
+
+STREAM_DESCRIPTION = "Stream the result as newline delimited JSON objects"
+
+
+def ndjson_response(models: AsyncIterator[BaseModel]) -> StreamingResponse:
+    """Send each model as one JSON line as soon as it is available."""
+
+    async def lines():
+        async for model in models:
+            yield model.json() + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
 @router.get("/bbox")
 async def get_locations_by_bbox(
@@ -33,13 +65,96 @@ async def get_locations_by_bbox(
     east: LongitudeCoordinate,
     north: LatitudeCoordinate,
     activities: list[str] | None = Query(None),
+    stream: bool = Query(False, description=STREAM_DESCRIPTION),
 ) -> list[LocationShortApi]:
     bbox = ((west, south), (east, north))
-    short: list[LocationShortDb] = await location_service.get_bbox_short(
-        bbox, activities
+    if stream:
+        return ndjson_response(
+            LocationShortApi(**loc.dict())
+            async for loc in location_service.iter_bbox_short(bbox, activities)
+        )
+
+    short = await location_service.get_bbox_short_raw(bbox, activities)
+    return RawJsonResponse(short)
+
+
+@router.get("/bbox/facets")
+async def get_activity_facets_by_bbox(
+    west: LongitudeCoordinate,
+    south: LatitudeCoordinate,
+    east: LongitudeCoordinate,
+    north: LatitudeCoordinate,
+) -> LocationFacetsApi:
+    """Number of locations per activity in the bbox, e.g. for filter chips."""
+    bbox = ((west, south), (east, north))
+    count, activity_counts = await location_service.get_bbox_facets(bbox)
+    return LocationFacetsApi(count=count, activity_counts=activity_counts)
+
+
+@router.get("/clusters")
+async def get_location_clusters_by_bbox(
+    west: LongitudeCoordinate,
+    south: LatitudeCoordinate,
+    east: LongitudeCoordinate,
+    north: LatitudeCoordinate,
+    zoom: int = Query(ge=0, le=24, description="Zoom level of the map"),
+    activities: list[str] | None = Query(None),
+) -> LocationClustersApi:
+    """
+    Like `/bbox`, but dense areas are merged into clusters for the given zoom
+    level. Sparse areas or high zoom levels return the locations themselves.
+    """
+    bbox = ((west, south), (east, north))
+    clusters, locations = await location_service.get_bbox_clusters(
+        bbox, zoom, activities
+    )
+
+    return LocationClustersApi(
+        clusters=[
+            LocationCluster(
+                location=GeoJsonLocation(coordinates=list(c.coordinates)),
+                count=c.count,
+                activity_counts=dict(c.activities),
+            )
+            for c in clusters
+        ],
+        locations=[LocationShortApi(**loc.dict()) for loc in locations],
+    )
+
+
+@router.get(
+    "/tiles/{z}/{x}/{y}",
+    response_class=Response,
+    responses={200: {"content": {tiles.MEDIA_TYPE: {}}}},
+)
+async def get_location_tile(
+    z: int = Path(ge=tiles.MIN_TILE_ZOOM, le=tiles.MAX_TILE_ZOOM),
+    x: int = Path(ge=0),
+    y: int = Path(ge=0),
+):
+    """
+    All locations inside the slippy map tile `z/x/y` as packed binary tile.
+    See `backend/util/tiles.py` for the format.
+    """
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(404, "Tile does not exist!")
+
+    short = await location_service.get_bbox_short_raw(tiles.tile_bbox(z, x, y), None)
+    content = tiles.encode_tile(
+        z,
+        x,
+        y,
+        (
+            (loc["id"], *loc["location"]["coordinates"], loc["activity_types"])
+            for loc in short
+        ),
+    )
+
+    return Response(
+        content=content,
+        media_type=tiles.MEDIA_TYPE,
+        headers={"Cache-Control": f"public, max-age={TILE_MAX_AGE}"},
     )
-    result: list[LocationShortApi] = [LocationShortApi(**loc.dict()) for loc in short]
-    return result
 
 
 @router.get("/around")
@@ -49,44 +164,102 @@ async def get_locations_around(
     radius: Annotated[float | None, "Distance in km"] = Query(None),
     activities: list[str] | None = Query(None),
     limit: int = Query(default=20, description="Closest n locations to be returned"),
+    stream: bool = Query(False, description=STREAM_DESCRIPTION),
 ) -> list[LocationDetailedApi]:
     center = (long, lat)
-    short = await location_service.get_around(
+    if stream:
+        return ndjson_response(
+            LocationDetailedApi(**loc.dict())
+            async for loc in location_service.iter_around(
+                center=center, radius=radius, activities=activities, limit=limit
+            )
+        )
+
+    locations = await location_service.get_around_raw(
         center=center, radius=radius, activities=activities, limit=limit
     )
-    result: list[LocationDetailedApi] = [
-        LocationDetailedApi(**loc.dict()) for loc in short
-    ]
-    return result
+    return RawJsonResponse(locations)
+
+
+@router.get("/search")
+async def search_locations(
+    q: Annotated[str, Query(min_length=1, description="Name or beginning of it")],
+    west: LongitudeCoordinate | None = None,
+    south: LatitudeCoordinate | None = None,
+    east: LongitudeCoordinate | None = None,
+    north: LatitudeCoordinate | None = None,
+    long: LongitudeCoordinate | None = None,
+    lat: LatitudeCoordinate | None = None,
+    radius: Annotated[float | None, "Distance in km"] = Query(None),
+    activities: list[str] | None = Query(None),
+    limit: int = Query(default=20, ge=1, le=100),
+) -> list[LocationShortApi]:
+    """
+    Autocomplete locations by name and some tags, best matches first.
+    Results can be restricted to a bbox or to `radius` km around long/lat.
+    """
+    bbox = None
+    if None not in (west, south, east, north):
+        bbox = ((west, south), (east, north))
+    center = None if long is None or lat is None else (long, lat)
+
+    locations = await location_service.search(
+        q, bbox, center, radius, activities, limit
+    )
+    return [LocationShortApi(**loc.dict()) for loc in locations]
+
+
+@router.get("/bulk")
+async def get_location_bulk(
+    location_ids: list[PydanticObjectId] = Query(alias="id"),
+) -> LocationBulkApi:
+    """
+    Get many locations at once, in the order of the given ids.
+    Ids of locations that don't exist are returned in `missing`.
+    """
+    locations, missing = await location_service.get_bulk_raw(location_ids)
+    return RawJsonResponse({"locations": locations, "missing": missing})
+
+
+def location_etag(location_id: PydanticObjectId, last_modified: datetime) -> str:
+    return make_etag("location", location_id, last_modified.isoformat())
 
 
 @router.get("/{location_id}")
-async def get_location(location_id: PydanticObjectId) -> LocationDetailedApi:
+async def get_location(
+    location_id: PydanticObjectId, request: Request, response: Response
+) -> LocationDetailedApi:
+    if is_conditional(request):
+        last_modified = await location_service.get_last_modified(location_id)
+        if last_modified is None:
+            raise HTTPException(404, detail=f"No location with {location_id=} exists!")
+
+        etag = location_etag(location_id, last_modified)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
     result = await location_service.get(location_id)
     if result is None:
         raise HTTPException(404, detail=f"No location with {location_id=} exists!")
-    return LocationDetailedApi(**result.dict())
 
-
-@router.get("/bulk")
-async def get_location_bulk(location_ids: list[PydanticObjectId] = Query(alias="id")):
-    ids = list(set(location_ids))  # remove duplicates
-    locations = []
-    for id in ids:
-        loc = await location_service.get(id)
-        if loc:
-            locations.append(loc)
-
-    return [LocationDetailedApi(**loc.dict()) for loc in locations]
+    etag = location_etag(location_id, result.last_modified)
+    response.headers.update(cache_headers(etag, result.last_modified))
+    return LocationDetailedApi(**result.dict())
 
 
 class CreateLocationResponse(BaseModel):
     id: PydanticObjectId
+    # similar locations close by, the new one might be a duplicate of them
+    possible_duplicates: list[PossibleDuplicate] = []
 
 
 @router.post("/")
 async def create_new_location(
-    adding_user: ApiUser, info: LocationNew
+    adding_user: ApiUser,
+    info: LocationNew,
+    ignore_duplicates: Annotated[
+        bool, Query(description="Add the location even if duplicates are rejected")
+    ] = False,
 ) -> CreateLocationResponse:
     try:
         trust_score = await user_service.check_eligible_to_add(adding_user.id)
@@ -101,24 +274,56 @@ async def create_new_location(
         trust_score=trust_score,
         photos=[],
     )
-    new_id = await location_service.insert(detailed, adding_user.id)
+    try:
+        new_id, duplicates = await location_service.insert(
+            detailed, adding_user.id, ignore_duplicates
+        )
+    except errors.LocationPossibleDuplicate as e:
+        raise HTTPException(
+            409,
+            {
+                "message": "Location might be a duplicate!",
+                "possible_duplicates": jsonable_encoder(e.duplicates),
+            },
+        )
 
-    return CreateLocationResponse(id=new_id)
+    return CreateLocationResponse(id=new_id, possible_duplicates=duplicates)
 
 
 @router.put("/")
 async def update_location(user: ApiUser, location_info: LocationHistoryIn):
     try:
         await location_service.update(user, location_info)
-    except Exception as e:
-        print(e)
-        raise HTTPException(400, f"Some error occured! {type(e)}, {e}")
+    except errors.LocationDoesNotExist:
+        raise HTTPException(404, "Location does not exist!")
+    except errors.LocationUpdateConflict as e:
+        raise HTTPException(
+            409,
+            "Location was changed meanwhile or before data does not match! "
+            f"Current version: {e.version}",
+        )
+    except errors.InvalidUpdateType as e:
+        raise HTTPException(400, f"{e} can not be updated!")
+    except errors.InvalidHistory:
+        raise HTTPException(400, "Invalid update!")
 
 
 @router.get("/{location_id}/update-history")
-async def get_location_history(location_id: PydanticObjectId, offset: int = 0):
-    history = await location_service.get_history(location_id, offset)
-    return history
+async def get_location_history(
+    location_id: PydanticObjectId,
+    cursor: str | None = None,
+    size: int = Query(
+        constants.HISTORY_PAGE_SIZE, ge=1, le=constants.HISTORY_MAX_PAGE_SIZE
+    ),
+) -> LocationHistoryPage:
+    try:
+        history, next_cursor = await location_service.get_history(
+            location_id, cursor, size
+        )
+    except errors.InvalidCursor:
+        raise HTTPException(400, "Invalid cursor!")
+
+    return LocationHistoryPage(history=history, next_cursor=next_cursor)
 
 
 @router.post("/report-update/{update_id}")
@@ -146,16 +351,35 @@ def delete_location(location_id: int):
 review_router = APIRouter(prefix="/{location_id}/reviews", tags=["reviews"])
 
 
+def reviews_page_etag(location_id, offset, n, versions) -> str:
+    return make_etag("reviews", location_id, offset, n, *versions)
+
+
 @review_router.get("/")
 async def get_reviews(
-    location_id: PydanticObjectId, offset: int = 0, n: int = 10
+    location_id: PydanticObjectId,
+    request: Request,
+    response: Response,
+    offset: int = 0,
+    n: int = 10,
 ) -> ReviewsPage:
     """
     Get `n` reviews starting from the `offset`th entry.
     """
 
+    if is_conditional(request):
+        versions = await review_service.get_page_version(location_id, offset, n)
+        etag = reviews_page_etag(location_id, offset, n, versions)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+
     reviews, new_offset = await review_service.get_page(location_id, offset, n)
 
+    versions = [r.creation_date for r in reviews]
+    response.headers.update(
+        cache_headers(reviews_page_etag(location_id, offset, n, versions))
+    )
+
     reviews = [ReviewWithId(**r.dict()) for r in reviews]
 
     return ReviewsPage(reviews=reviews, next_offset=new_offset)
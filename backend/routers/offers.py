@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from beanie import PydanticObjectId
 from fastapi import APIRouter, Body, HTTPException, Query
@@ -6,8 +6,10 @@ from pydantic import BaseModel
 
 from backend.database.models.offers import (
     Offer,
+    OfferAroundOut,
     OfferIn,
     OfferOut,
+    OffersPage,
     OfferStatus,
     OfferTimeFlexible,
     OfferTimeSingle,
@@ -19,7 +21,8 @@ from backend.database.service import (
     user_service,
 )
 from backend.routers.auth import ApiUser
-from backend.util import errors
+from backend.util import constants, errors
+from backend.util.serialization import RawJsonResponse
 from backend.util.types import LatitudeCoordinate, LongitudeCoordinate
 
 router = APIRouter(prefix="/offers", tags=["offers"])
@@ -52,6 +55,28 @@ def create_search_time(time_from: datetime | None, time_until: datetime | None):
     return OfferTimeSingle(times=(time_from, time_until))
 
 
+def _naive_utc(time: datetime) -> datetime:
+    if time.tzinfo is None:
+        return time
+    return time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def create_time_window(time_from: datetime | None, time_until: datetime | None):
+    """
+    The window for listing offers, either end may be open. Unlike the search
+    time, it may lie in the past.
+    """
+    if time_from is None and time_until is None:
+        return OfferTimeFlexible()
+
+    time_from = datetime.min if time_from is None else _naive_utc(time_from)
+    time_until = datetime.max if time_until is None else _naive_utc(time_until)
+    if time_until < time_from:
+        raise HTTPException(400, "Invalid `until` time!")
+
+    return OfferTimeSingle(times=(time_from, time_until))
+
+
 def to_offer_out(offer):
     return OfferOut(**offer.dict())
 
@@ -68,6 +93,18 @@ def include_location_for_host(offers: list[Offer], user_id: PydanticObjectId):
     return res
 
 
+def hide_location_raw(offers: list[dict], user_id: PydanticObjectId):
+    for offer in offers:
+        if offer["user_info"]["id"] != user_id:
+            offer["location"] = None
+
+    return offers
+
+
+def include_location_for_host_raw(offers: list[dict], user_id: PydanticObjectId):
+    return RawJsonResponse(hide_location_raw(offers, user_id))
+
+
 @router.post("/")
 async def create_offer(user: ApiUser, offer_info: OfferIn) -> OfferOut:
     try:
@@ -83,19 +120,42 @@ async def get_offers(
     user: ApiUser,
     offer_ids: list[PydanticObjectId] | None = Query(None, alias="id"),
     all: bool = Query(False, alias="all-for-user"),
-) -> list[OfferOut]:
+    status: list[OfferStatus] | None = Query(None),
+    time_from: datetime = Query(None),
+    time_until: datetime = Query(None),
+    cursor: str | None = None,
+    size: int = Query(
+        constants.OFFERS_PAGE_SIZE, ge=1, le=constants.OFFERS_MAX_PAGE_SIZE
+    ),
+) -> list[OfferOut] | OffersPage:
+    """
+    The offers with the given `id`s, or with `all-for-user` the user's offers
+    with the given statuses (all of them by default), newest first and
+    paginated by `cursor`.
+    """
     if all:
-        offers = await offer_service.get_for_user(user)
-    else:
-        if not offer_ids:
-            raise HTTPException(
-                403, "Either `all-for-user` must be true, or `id`s given!"
+        window = create_time_window(time_from, time_until)
+        try:
+            offers, next_cursor = await offer_service.get_for_user_raw(
+                user, status, window, cursor, size
             )
+        except errors.InvalidCursor:
+            raise HTTPException(400, "Invalid cursor!")
 
-        ids = list(set(offer_ids))  # remove duplicates
-        offers = await offer_service.get_bulk(ids)
+        return RawJsonResponse(
+            {
+                "offers": hide_location_raw(offers, user.id),
+                "next_cursor": next_cursor,
+            }
+        )
 
-    return include_location_for_host(offers, user.id)
+    if not offer_ids:
+        raise HTTPException(403, "Either `all-for-user` must be true, or `id`s given!")
+
+    ids = list(set(offer_ids))  # remove duplicates
+    offers = await offer_service.get_bulk_raw(ids)
+
+    return include_location_for_host_raw(offers, user.id)
 
 
 @router.get("/location/{location_id}")
@@ -124,13 +184,21 @@ async def get_offers_in_area(
     time_from: datetime = Query(None),
     time_until: datetime = Query(None),
     activities: list[str] = Query(None),
-) -> list[OfferOut]:
+) -> list[OfferAroundOut]:
     search_time = create_search_time(time_from, time_until)
     offers = await offer_service.get_around(
         user, (long, lat), radius, search_time, activities
     )
 
-    return include_location_for_host(offers, user.id)
+    res = []
+    for offer, distance in offers:
+        out = OfferAroundOut(**offer.dict(), distance=distance)
+        if out.user_info.id != user.id:
+            out.location = None
+
+        res.append(out)
+
+    return res
 
 
 @router.put("/me/{offer_id}")
@@ -149,7 +217,20 @@ async def set_offer_status(
 async def request_to_join(
     user: ApiUser, offer_id: PydanticObjectId, message: str = Body()
 ):
-    await offer_service.request_to_join(user=user, offer_id=offer_id, message=message)
+    try:
+        await offer_service.request_to_join(
+            user=user, offer_id=offer_id, message=message
+        )
+    except errors.OfferDoesNotExist:
+        raise HTTPException(404, "Offer does not exist!")
+    except errors.UserAlreadyRequestedToJoin:
+        raise HTTPException(409, "User already requested to join!")
+    except errors.OfferIsNotOpen:
+        raise HTTPException(409, "Offer is not open!")
+    except errors.OfferIsFull:
+        raise HTTPException(409, "Offer is full!")
+    except errors.OfferUpdateConflict:
+        raise HTTPException(409, "Offer changed too often, try again!")
 
 
 # @router.put("/{offer_id}")
@@ -199,15 +280,41 @@ def unignore_offers_from_user():
 async def decline_request(
     user: ApiUser, offer_id: PydanticObjectId, user_id: PydanticObjectId
 ):
-    await offer_service.decline_request(
-        host=user, offer_id=offer_id, participant_id=user_id
-    )
+    try:
+        await offer_service.decline_request(
+            host=user, offer_id=offer_id, participant_id=user_id
+        )
+    except errors.OfferDoesNotExist:
+        raise HTTPException(404, "Offer does not exist!")
+    except errors.UserDoesNotOwnOffer:
+        raise HTTPException(401, "User does not own offer!")
+    except errors.UserIsNotParticipant:
+        raise HTTPException(404, "User is not a participant!")
+    except errors.ParticipantStatusUnchanged:
+        raise HTTPException(409, "Participant is already declined!")
+    except errors.OfferUpdateConflict:
+        raise HTTPException(409, "Offer changed too often, try again!")
 
 
 @router.put("/me/{offer_id}/accept/{user_id}")
 async def accept_request(
     user: ApiUser, offer_id: PydanticObjectId, user_id: PydanticObjectId
 ):
-    await offer_service.accept_request(
-        host=user, offer_id=offer_id, participant_id=user_id
-    )
+    try:
+        await offer_service.accept_request(
+            host=user, offer_id=offer_id, participant_id=user_id
+        )
+    except errors.OfferDoesNotExist:
+        raise HTTPException(404, "Offer does not exist!")
+    except errors.UserDoesNotOwnOffer:
+        raise HTTPException(401, "User does not own offer!")
+    except errors.UserIsNotParticipant:
+        raise HTTPException(404, "User is not a participant!")
+    except errors.ParticipantStatusUnchanged:
+        raise HTTPException(409, "Participant is already accepted!")
+    except errors.OfferIsNotOpen:
+        raise HTTPException(409, "Offer is not open!")
+    except errors.OfferIsFull:
+        raise HTTPException(409, "Offer is full!")
+    except errors.OfferUpdateConflict:
+        raise HTTPException(409, "Offer changed too often, try again!")
@@ -2,13 +2,14 @@ from datetime import datetime
 from typing import Annotated
 
 from beanie import PydanticObjectId
-from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
 import backend.util.errors as E
 from backend.database.models.shared import PhotoInfo, PhotoUrl
 from backend.database.models.users import (
+    User,
     UserApiIn,
     UserApiOut,
     UserDetailed,
@@ -17,6 +18,13 @@ from backend.database.models.users import (
 )
 from backend.database.service import relation_service, user_service
 from backend.routers.auth import ApiUser, authenticate_user, get_current_user, login
+from backend.util.conditional import (
+    cache_headers,
+    is_conditional,
+    is_not_modified,
+    make_etag,
+    not_modified,
+)
 from backend.util.crypto import (
     ChangePasswordForm,
     ResetPasswordForm,
@@ -203,11 +211,36 @@ async def verify_new_user(verify_info: VerifyUserInfo) -> bool:
         raise HTTPException(500, str(e))
 
 
+def users_etag(versions: dict[PydanticObjectId, datetime]) -> str:
+    return make_etag(
+        "users", *sorted(f"{id}:{date.isoformat()}" for id, date in versions.items())
+    )
+
+
 @router.get("/id")
 async def get_user_infos(
+    request: Request,
+    response: Response,
     ids: list[PydanticObjectId] = Query(alias="q"),
 ) -> list[UserApiOut]:
     ids = list(set(ids))
+    if ids and is_conditional(request):
+        versions = await user_service.get_versions(ids)
+        etag = users_etag(versions)
+        last_modified = max(versions.values(), default=None)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
+
+    users = await _get_user_infos(ids)
+
+    versions = {u.id: u.last_modified or u.creation_date for u in users}
+    last_modified = max(versions.values(), default=None)
+    response.headers.update(cache_headers(users_etag(versions), last_modified))
+
+    return [UserApiOut(**u.dict()) for u in users]
+
+
+async def _get_user_infos(ids: list[PydanticObjectId]) -> list[User]:
     match len(ids):
         case 0:
             return []
@@ -216,10 +249,9 @@ async def get_user_infos(
             if not u:
                 raise HTTPException(404, "User not found!")
 
-            return [UserApiOut(**u.dict())]
+            return [u]
         case _:
-            us = await user_service.get_bulk_by_id(ids)
-            return [UserApiOut(**u.dict()) for u in us]
+            return await user_service.get_bulk_by_id(ids)
 
 
 @router.put("/reset_password")
@@ -0,0 +1,53 @@
+"""
+Drop the legacy 2d indexes of the location collections.
+
+Bbox queries use `$geoWithin` with a polygon on the 2dsphere index now, so the
+`location_index_GEO2D` indexes are only maintained, never used. Beanie doesn't
+drop indexes that are no longer declared, hence this migration.
+
+Run from the project root, e.g. `python -m backend.tools.drop_geo2d_indexes`.
+It is safe to run it more than once.
+"""
+
+import argparse
+import asyncio
+
+from backend.database.connection import init as init_db
+from backend.database.models.locations import LocationDetailedDb, LocationShortDb
+
+LEGACY_INDEX = "location_index_GEO2D"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Drops the unused 2d indexes of the location collections"
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="Only show which indexes would be dropped",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    await init_db()
+
+    for model in [LocationDetailedDb, LocationShortDb]:
+        collection = model.get_motor_collection()
+        indexes = await collection.index_information()
+        if LEGACY_INDEX not in indexes:
+            print(f"{collection.name}: no {LEGACY_INDEX} index")
+            continue
+
+        if args.dry_run:
+            print(f"{collection.name}: would drop {LEGACY_INDEX}")
+            continue
+
+        await collection.drop_index(LEGACY_INDEX)
+        print(f"{collection.name}: dropped {LEGACY_INDEX}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
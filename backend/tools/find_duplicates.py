@@ -0,0 +1,55 @@
+"""
+Find possible duplicates among all locations, e.g. after an OSM import.
+
+Run from the project root, e.g. `python -m backend.tools.find_duplicates > dups.jsonl`.
+Every line of the output is one pair of locations that might be the same.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from backend.database.connection import init as init_db
+from backend.database.service import location_service
+from backend.database.service.locations import DUPLICATE_BLOCK_SIZE
+from backend.util.serialization import dumps
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Writes possible duplicate locations as JSON lines to stdout"
+    )
+    parser.add_argument(
+        "--block-size",
+        help="Edge length in degrees of the blocks loaded at once",
+        type=float,
+        default=DUPLICATE_BLOCK_SIZE,
+    )
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    await init_db()
+
+    count = 0
+    async for loc, other, distance, score in location_service.iter_duplicate_pairs(
+        args.block_size
+    ):
+        print(
+            dumps(
+                {
+                    "location": loc,
+                    "duplicate": other,
+                    "distance": round(distance, 1),
+                    "score": round(score, 3),
+                }
+            )
+        )
+        count += 1
+
+    print(f"Found {count} possible duplicates", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,375 @@
+"""
+Explain the query shapes the services use and flag the ones without a fitting index.
+
+Run from the project root, e.g. `python -m backend.tools.index_audit`.
+Queries that scan the whole collection (COLLSCAN) or sort in memory (SORT) are
+reported together with a proposed compound index. With `--check`, the exit code
+is non-zero if one of the hot queries is affected, so it can guard against
+index regressions, e.g. in CI against a database with the declared indexes.
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Iterator, NamedTuple
+
+from beanie import Document, PydanticObjectId
+from beanie.odm.operators.find.comparison import Eq
+from pymongo.errors import OperationFailure
+
+from backend.database.connection import init as init_db
+from backend.database.models.locations import (
+    LocationDetailedDb,
+    LocationFacetCell,
+    LocationHistory,
+    LocationShortDb,
+    LocationUpdateReport,
+    Review,
+    ReviewReport,
+)
+from backend.database.models.offers import Offer, OfferStatus, OfferTimeSingle
+from backend.database.models.users import Chat, User, UserRelation
+from backend.database.service import (
+    chat_service,
+    location_service,
+    offer_service,
+    relation_service,
+    user_service,
+)
+from backend.database.service.expiry import expired_filter
+from backend.database.service.offers import USER_OFFERS_SORT
+from backend.util.duplicates import DUPLICATE_RADIUS
+from backend.util.pagination import encode_cursor
+
+# plan stages that mean a query doesn't have a fitting index
+BAD_STAGES = {"COLLSCAN", "SORT"}
+GEO_OPERATORS = {"$near", "$nearSphere", "$geoWithin", "$geoIntersects"}
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$regex", "$exists"}
+
+BBOX = ((8.4, 47.3), (8.6, 47.4))
+CENTER = (8.5, 47.35)
+
+
+class QueryShape(NamedTuple):
+    name: str
+    model: type[Document]
+    filter: dict[str, Any]
+    sort: list[tuple[str, int]] | None = None
+    # explain this aggregation instead of a find with the filter
+    pipeline: list[dict[str, Any]] | None = None
+    # queries run on most requests, they fail the check
+    hot: bool = True
+
+
+def offers_query(*filters) -> dict[str, Any]:
+    return Offer.find(*filters).get_filter_query()
+
+
+def query_shapes() -> list[QueryShape]:
+    """
+    The queries of `backend/database/service/*`, with example values. The
+    shapes are built by the services' own queries and query builders where
+    there are any, so they can't drift apart.
+    """
+    id = PydanticObjectId()
+    user = User.construct(id=id)
+    ids = [PydanticObjectId() for _ in range(3)]
+    cursor_filter = {
+        "$or": [{"date": {"$lt": datetime.utcnow()}}, {"date": datetime.utcnow()}]
+    }
+    search_time = OfferTimeSingle(
+        times=(datetime.utcnow(), datetime.utcnow() + timedelta(days=1))
+    )
+    around = offer_service._around_pipeline(user, CENTER, 5, search_time, ["soccer"])
+    chats = chat_service.get_all_chats(user)
+
+    return [
+        QueryShape(
+            "locations.bbox",
+            LocationShortDb,
+            location_service._bbox_query(BBOX, None).get_filter_query(),
+        ),
+        QueryShape(
+            "locations.bbox_activities",
+            LocationShortDb,
+            location_service._bbox_query(BBOX, ["soccer"]).get_filter_query(),
+        ),
+        QueryShape(
+            "locations.around",
+            LocationDetailedDb,
+            location_service._around_query(
+                CENTER, ["soccer"], 5, 20
+            ).get_filter_query(),
+        ),
+        QueryShape("locations.bulk", LocationDetailedDb, {"_id": {"$in": ids}}),
+        QueryShape(
+            "locations.duplicates",
+            LocationDetailedDb,
+            {},
+            pipeline=[
+                {
+                    "$geoNear": {
+                        "near": {"type": "Point", "coordinates": list(CENTER)},
+                        "key": "location",
+                        "distanceField": "distance",
+                        "maxDistance": DUPLICATE_RADIUS,
+                        "spherical": True,
+                    }
+                }
+            ],
+        ),
+        QueryShape(
+            "locations.search_fallback",
+            LocationShortDb,
+            {"name": {"$regex": "^sport", "$options": "i"}},
+            hot=False,
+        ),
+        QueryShape(
+            "locations.facet_cells",
+            LocationFacetCell,
+            {"x": {"$gte": 0, "$lt": 10}, "y": {"$gte": 0, "$lt": 10}},
+        ),
+        QueryShape("locations.osm_id", LocationDetailedDb, {"osm_id": 1}, hot=False),
+        QueryShape(
+            "history.page",
+            LocationHistory,
+            {"location_id": id} | cursor_filter,
+            sort=[("date", -1), ("_id", -1)],
+        ),
+        QueryShape(
+            "update_reports.by_user",
+            LocationUpdateReport,
+            {"user_id": id},
+            hot=False,
+        ),
+        QueryShape("reviews.page", Review, {"location_id": id}),
+        QueryShape("reviews.from_user", Review, {"user_id": id, "location_id": id}),
+        QueryShape(
+            "review_reports.from_user",
+            ReviewReport,
+            {"user_id": id, "review_id": id},
+            hot=False,
+        ),
+        QueryShape(
+            "offers.at_location",
+            Offer,
+            offers_query(
+                Eq(Offer.location.id, id), *offer_service._visible_filters(user)
+            ),
+        ),
+        QueryShape(
+            "offers.at_location_time",
+            Offer,
+            offers_query(
+                Eq(Offer.location.id, id),
+                *offer_service._visible_filters(user, search_time),
+            ),
+        ),
+        QueryShape(
+            "offers.around",
+            Offer,
+            around[0]["$geoNear"]["query"],
+            pipeline=around,
+        ),
+        QueryShape("offers.expiry_sweep", Offer, expired_filter(datetime.utcnow())),
+        QueryShape("offers.bulk", Offer, {"_id": {"$in": ids}}),
+        QueryShape(
+            "offers.for_user",
+            Offer,
+            offers_query(
+                *offer_service._user_filters(
+                    user,
+                    OfferStatus.OPEN,
+                    search_time,
+                    encode_cursor(datetime.utcnow(), id),
+                )
+            ),
+            sort=USER_OFFERS_SORT,
+        ),
+        QueryShape("users.bulk", User, {"_id": {"$in": ids}}),
+        QueryShape(
+            "users.by_username",
+            User,
+            user_service.by_username_query("someone").get_filter_query(),
+        ),
+        QueryShape(
+            "users.login",
+            User,
+            user_service.by_email_query("someone@example.com").get_filter_query(),
+        ),
+        QueryShape(
+            "users.name_search",
+            User,
+            user_service.by_name_query("some").get_filter_query(),
+            hot=False,
+        ),
+        QueryShape(
+            "relations.of_user",
+            UserRelation,
+            relation_service.get_all_active_relations(user).get_filter_query(),
+        ),
+        QueryShape(
+            "relations.open",
+            UserRelation,
+            relation_service.get_open_relations(user).get_filter_query(),
+        ),
+        QueryShape(
+            "relations.between",
+            UserRelation,
+            relation_service.between_query([id, id]).get_filter_query(),
+        ),
+        QueryShape("chats.of_user", Chat, chats.get_filter_query()),
+        QueryShape(
+            "chats.new_messages",
+            Chat,
+            chats.get_filter_query(),
+            pipeline=[
+                {"$match": chats.get_filter_query()},
+                *chat_service.new_messages_pipeline(datetime.utcnow()),
+            ],
+        ),
+    ]
+
+
+async def explain(shape: QueryShape) -> dict[str, Any]:
+    collection = shape.model.get_motor_collection()
+    if shape.pipeline is not None:
+        command = {"aggregate": collection.name, "pipeline": shape.pipeline}
+        command["cursor"] = {}
+    else:
+        command = {"find": collection.name, "filter": shape.filter}
+        if shape.sort:
+            command["sort"] = dict(shape.sort)
+
+    return await collection.database.command(
+        {"explain": command, "verbosity": "queryPlanner"}
+    )
+
+
+def _plans(explained: Any) -> Iterator[dict[str, Any]]:
+    """All winning plans in the explain output, also those nested in aggregations."""
+    if isinstance(explained, dict):
+        for key, value in explained.items():
+            if key == "winningPlan":
+                # slot based engine plans wrap the classic plan
+                yield value.get("queryPlan", value)
+            else:
+                yield from _plans(value)
+    elif isinstance(explained, list):
+        for value in explained:
+            yield from _plans(value)
+
+
+def _stages(plan: dict[str, Any]) -> Iterator[dict[str, Any]]:
+    yield plan
+    if "inputStage" in plan:
+        yield from _stages(plan["inputStage"])
+    for stage in plan.get("inputStages", []):
+        yield from _stages(stage)
+
+
+def _fields(query: dict[str, Any]) -> tuple[list[str], list[str], list[str]]:
+    """Equality, range and geo fields of a filter."""
+    equality, ranges, geo = [], [], []
+    for field, value in query.items():
+        # beanie's expression fields compare like query operators, not like strings
+        field = str(field)
+        if field == "$and":
+            for sub in value:
+                e, r, g = _fields(sub)
+                equality += e
+                ranges += r
+                geo += g
+            continue
+        if field == "$or":
+            # ranges of the branches, e.g. a keyset cursor, usually share fields
+            for sub in value:
+                ranges += [f for f in sum(_fields(sub), []) if f not in ranges]
+            continue
+        if field.startswith("$"):
+            continue
+
+        operators = set(value) if isinstance(value, dict) else set()
+        if not operators or not all(op.startswith("$") for op in operators):
+            equality.append(field)
+        elif operators & GEO_OPERATORS:
+            geo.append(field)
+        elif "$elemMatch" in operators:
+            sub = value["$elemMatch"]
+            if all(k.startswith("$") for k in sub):
+                equality.append(field)
+            else:
+                equality += [f"{field}.{f}" for f in _fields(sub)[0]]
+        elif operators & RANGE_OPERATORS:
+            ranges.append(field)
+        else:
+            equality.append(field)
+
+    return equality, ranges, geo
+
+
+def propose_index(shape: QueryShape) -> list[tuple[str, Any]]:
+    """Compound index following the equality, sort, range rule."""
+    equality, ranges, geo = _fields(shape.filter)
+    keys: list[tuple[str, Any]] = [(f, "2dsphere") for f in geo]
+    for field in equality + [f for f, _ in shape.sort or []] + ranges:
+        if all(field != k for k, _ in keys):
+            direction = dict(shape.sort or []).get(field, 1)
+            keys.append((field, direction))
+
+    return keys
+
+
+async def audit(shape: QueryShape) -> tuple[bool, str]:
+    """Whether the query is served by an index, and a line describing its plan."""
+    try:
+        explained = await explain(shape)
+    except OperationFailure as e:
+        # e.g. geo queries without a geo index
+        return False, f"error: {e.details.get('errmsg', e)}"
+
+    stages = [s for plan in _plans(explained) for s in _stages(plan)]
+    names = {s["stage"] for s in stages}
+    indexes = sorted({s["indexName"] for s in stages if "indexName" in s})
+
+    bad = names & BAD_STAGES
+    if not bad:
+        return True, f"uses {', '.join(indexes) or 'no index needed'}"
+
+    return False, f"{'+'.join(sorted(bad))}, proposed index {propose_index(shape)}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Explains the service queries and flags missing indexes"
+    )
+    parser.add_argument(
+        "--check",
+        help="Exit with an error if a hot query is not served by an index",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+async def main() -> int:
+    args = parse_args()
+    # creates the declared indexes
+    await init_db()
+
+    failed = []
+    for shape in query_shapes():
+        ok, description = await audit(shape)
+        marker = "ok  " if ok else ("FAIL" if shape.hot else "warn")
+        print(f"{marker} {shape.name:<28} {description}")
+        if not ok and shape.hot:
+            failed.append(shape.name)
+
+    if failed:
+        print(f"{len(failed)} hot queries without a fitting index", file=sys.stderr)
+
+    return 1 if args.check and failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,58 @@
+"""
+Rebuild and/or follow the `simple_locations` collection from `locations`, and
+recount the precomputed activity counts per grid cell.
+
+Run from the project root, e.g. `python -m backend.tools.sync_locations --backfill`.
+"""
+
+import argparse
+import asyncio
+
+from backend.database.connection import init as init_db
+from backend.database.service import location_projector, location_service
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Syncs the short locations collection with the locations"
+    )
+    parser.add_argument(
+        "--backfill",
+        help="Write the short version of every location",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--reset",
+        help="Empty the short collection before the backfill",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--follow",
+        help="Follow the change stream afterwards (needs a replica set)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--facets",
+        help="Recount the activity counts per grid cell from the short locations",
+        action="store_true",
+    )
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    await init_db()
+
+    if args.backfill or args.reset:
+        await location_projector.backfill(reset=args.reset)
+
+    if args.facets:
+        await location_service.rebuild_facet_cells()
+        print("Recounted the activity counts per grid cell")
+
+    if args.follow:
+        await location_projector.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
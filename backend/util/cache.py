@@ -0,0 +1,84 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Keeps the `max_size` most recently used entries, each for at most `ttl`
+    seconds if given. Counts hits, misses, evictions and expirations, so the
+    size can be tuned.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        on_evict: Callable[[K, V], None] | None = None,
+        ttl: float | None = None,
+    ) -> None:
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.ttl = ttl
+        # value and the time it expires at
+        self._entries: OrderedDict[K, tuple[V, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V):
+        if self.max_size <= 0:
+            return
+
+        expires = math.inf if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            old_key, (old_value, _) = self._entries.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key: K) -> V | None:
+        entry = self._entries.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
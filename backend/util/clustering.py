@@ -0,0 +1,303 @@
+import math
+from collections import Counter
+from typing import Generic, Iterable, TypeVar
+
+import numpy as np
+
+from backend.util.types import BoundingBox
+
+T = TypeVar("T")
+
+MIN_ZOOM = 0
+# Beyond this zoom level hardly any points are merged anymore, every level would
+# hold almost all points again. Higher zooms are served by the bbox query.
+MAX_ZOOM = 12
+# cluster radius in pixels, relative to the tile extent
+CLUSTER_RADIUS = 60
+TILE_EXTENT = 512
+# web mercator is cut off here, the poles would be infinitely far away
+MAX_LATITUDE = 85.0511
+# edge length of the lookup grid cells of a zoom level, relative to a tile
+CELLS_PER_TILE = 4
+
+
+def project(long: float, lat: float) -> tuple[float, float]:
+    """Web mercator projection of long/lat to [0, 1] x [0, 1]."""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return long / 360 + 0.5, min(max(y, 0.0), 1.0)
+
+
+def project_many(long: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Like `project`, for arrays of longitudes and latitudes."""
+    sin = np.sin(np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)))
+    y = 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / np.pi
+    return long / 360 + 0.5, np.clip(y, 0.0, 1.0)
+
+
+def unproject(x: float, y: float) -> tuple[float, float]:
+    y2 = (180 - y * 360) * math.pi / 180
+    return (x - 0.5) * 360, 360 * math.atan(math.exp(y2)) / math.pi - 90
+
+
+class ClusterNode(Generic[T]):
+    """
+    A point on one zoom level. Either a single item, or a cluster of `count`
+    items with their activity counts summed up.
+    """
+
+    __slots__ = ("x", "y", "count", "activities", "item")
+
+    def __init__(
+        self,
+        x: float,
+        y: float,
+        count: int,
+        activities: Counter,
+        item: T | None = None,
+    ) -> None:
+        self.x = x
+        self.y = y
+        self.count = count
+        self.activities = activities
+        self.item = item
+
+    @property
+    def coordinates(self) -> tuple[float, float]:
+        return unproject(self.x, self.y)
+
+    @property
+    def is_cluster(self) -> bool:
+        return self.item is None
+
+
+class ClusterPoints(Generic[T]):
+    """
+    The points to cluster as flat arrays, projected to web mercator. Activities
+    are numbered, the pairs of `pair_points` and `pair_activities` list the
+    activities of all points. Several clusterings, e.g. for different activity
+    filters, can be built from the same points.
+    """
+
+    def __init__(self, points: Iterable[tuple[float, float, list[str], T]]) -> None:
+        longs, lats = [], []
+        self.items: list[T] = []
+        self._numbers: dict[str, int] = {}
+        pair_points, pair_activities = [], []
+        for i, (long, lat, activities, item) in enumerate(points):
+            longs.append(long)
+            lats.append(lat)
+            self.items.append(item)
+            for a in set(activities):
+                pair_points.append(i)
+                pair_activities.append(self._numbers.setdefault(a, len(self._numbers)))
+
+        self.activities = list(self._numbers)
+        self.x, self.y = project_many(
+            np.asarray(longs, dtype=np.float64), np.asarray(lats, dtype=np.float64)
+        )
+        self.pair_points = np.asarray(pair_points, dtype=np.int64)
+        self.pair_activities = np.asarray(pair_activities, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def known(self, activities: Iterable[str]) -> tuple[str, ...]:
+        """The given activities some point has, sorted."""
+        return tuple(sorted(set(activities) & self._numbers.keys()))
+
+    def having(self, activities: Iterable[str]) -> np.ndarray:
+        """Indices of the points with one of the activities."""
+        numbers = [self._numbers[a] for a in activities if a in self._numbers]
+        return np.unique(self.pair_points[np.isin(self.pair_activities, numbers)])
+
+
+class _Level:
+    """
+    The nodes of one zoom level as flat arrays, sorted by their cell of the
+    lookup grid. `item` is the index of the point of single point nodes and -1
+    for clusters. The activity counts of node i are in the range
+    [offsets[i], offsets[i + 1]) of `activities` and `activity_counts`.
+    """
+
+    __slots__ = (
+        "cells",
+        "keys",
+        "x",
+        "y",
+        "count",
+        "item",
+        "offsets",
+        "activities",
+        "activity_counts",
+    )
+
+
+class PointClusterer(Generic[T]):
+    """
+    Hierarchical grid clustering of points in web mercator space.
+
+    Starting from the raw points, each zoom level is computed from the level
+    above by merging the nodes in each grid cell of `radius` pixels into their
+    weighted centroid. All levels are precomputed on `load` and stored as flat
+    arrays, so queries only have to look up a range of cells per grid row.
+    """
+
+    def __init__(
+        self,
+        radius: int = CLUSTER_RADIUS,
+        extent: int = TILE_EXTENT,
+        min_zoom: int = MIN_ZOOM,
+        max_zoom: int = MAX_ZOOM,
+    ) -> None:
+        self.radius = radius
+        self.extent = extent
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._points: ClusterPoints[T] | None = None
+        self._levels: dict[int, _Level] = {}
+
+    def load(self, points: ClusterPoints[T], selection: np.ndarray | None = None):
+        """Build all zoom levels from the points, or the selected ones of them."""
+        self._points = points
+        if selection is None:
+            selection = np.arange(len(points), dtype=np.int64)
+
+        x, y = points.x[selection], points.y[selection]
+        count = np.ones(len(selection), dtype=np.int64)
+        item = selection.astype(np.int64)
+
+        # the activity pairs of the selected points, by node
+        node_of = np.full(len(points), -1, dtype=np.int64)
+        node_of[selection] = np.arange(len(selection))
+        pair_nodes = node_of[points.pair_points]
+        kept = pair_nodes >= 0
+        pair_nodes, pair_activities = pair_nodes[kept], points.pair_activities[kept]
+        pair_counts = np.ones(len(pair_nodes), dtype=np.int64)
+
+        self._levels = {}
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            x, y, count, item, parent = self._cluster(x, y, count, item, zoom)
+            pair_nodes, pair_activities, pair_counts = _sum_pairs(
+                parent[pair_nodes], pair_activities, pair_counts, len(points.activities)
+            )
+            self._levels[zoom] = self._to_level(
+                x, y, count, item, pair_nodes, pair_activities, pair_counts, zoom
+            )
+
+    def _cluster(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        count: np.ndarray,
+        item: np.ndarray,
+        zoom: int,
+    ):
+        """Merge the nodes per cell, returns the new nodes and the one of each node."""
+        r = self.radius / (self.extent * 2**zoom)
+        per_row = math.ceil(1 / r) + 1
+        cell = np.floor(y / r).astype(np.int64) * per_row + np.floor(x / r).astype(
+            np.int64
+        )
+        cells, parent = np.unique(cell, return_inverse=True)
+        parent = parent.reshape(-1)
+
+        weights = np.bincount(parent, weights=count, minlength=len(cells))
+        merged_x = (
+            np.bincount(parent, weights=x * count, minlength=len(cells)) / weights
+        )
+        merged_y = (
+            np.bincount(parent, weights=y * count, minlength=len(cells)) / weights
+        )
+        merged_count = weights.astype(np.int64)
+
+        # nodes of a single point keep it as their item
+        member = np.empty(len(cells), dtype=np.int64)
+        member[parent] = np.arange(len(parent))
+        merged_item = np.where(merged_count == 1, item[member], -1)
+
+        return merged_x, merged_y, merged_count, merged_item, parent
+
+    def _to_level(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        count: np.ndarray,
+        item: np.ndarray,
+        pair_nodes: np.ndarray,
+        pair_activities: np.ndarray,
+        pair_counts: np.ndarray,
+        zoom: int,
+    ) -> _Level:
+        level = _Level()
+        level.cells = 2**zoom * CELLS_PER_TILE
+        keys = _cells_of(y, level.cells) * level.cells + _cells_of(x, level.cells)
+        order = np.argsort(keys, kind="stable")
+        level.keys = keys[order]
+        level.x, level.y = x[order], y[order]
+        level.count = count[order].astype(np.int32)
+        level.item = item[order].astype(np.int32)
+
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        pair_nodes = rank[pair_nodes]
+        pair_order = np.argsort(pair_nodes, kind="stable")
+        level.activities = pair_activities[pair_order].astype(np.int32)
+        level.activity_counts = pair_counts[pair_order].astype(np.int32)
+        level.offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_nodes, minlength=len(order)), out=level.offsets[1:])
+        return level
+
+    def get_clusters(self, bbox: BoundingBox, zoom: int) -> list[ClusterNode[T]]:
+        """Nodes of the given zoom level inside the bbox."""
+        zoom = min(max(zoom, self.min_zoom), self.max_zoom)
+        level = self._levels.get(zoom)
+        if level is None or len(level.keys) == 0:
+            return []
+
+        (west, south), (east, north) = bbox
+        x0, y0 = project(west, north)
+        x1, y1 = project(east, south)
+        cx0, cx1 = _cells_of(np.array([x0, x1]), level.cells)
+        cy0, cy1 = _cells_of(np.array([y0, y1]), level.cells)
+
+        rows = np.arange(cy0, cy1 + 1, dtype=np.int64) * level.cells
+        starts = np.searchsorted(level.keys, rows + cx0, side="left")
+        ends = np.searchsorted(level.keys, rows + cx1, side="right")
+        candidates = np.concatenate(
+            [np.arange(s, e) for s, e in zip(starts, ends)] or [np.empty(0, int)]
+        )
+        cx, cy = level.x[candidates], level.y[candidates]
+        inside = candidates[(x0 <= cx) & (cx <= x1) & (y0 <= cy) & (cy <= y1)]
+        return [self._node(level, i) for i in inside]
+
+    def _node(self, level: _Level, i: int) -> ClusterNode[T]:
+        start, end = level.offsets[i], level.offsets[i + 1]
+        activities = Counter(
+            {
+                self._points.activities[a]: int(c)
+                for a, c in zip(
+                    level.activities[start:end], level.activity_counts[start:end]
+                )
+            }
+        )
+        item = self._points.items[level.item[i]] if level.item[i] >= 0 else None
+        return ClusterNode(
+            float(level.x[i]), float(level.y[i]), int(level.count[i]), activities, item
+        )
+
+
+def _cells_of(values: np.ndarray, cells: int) -> np.ndarray:
+    """Cells of projected coordinates in a grid with `cells` cells per row."""
+    return np.clip(np.floor(values * cells).astype(np.int64), 0, cells - 1)
+
+
+def _sum_pairs(
+    nodes: np.ndarray, activities: np.ndarray, counts: np.ndarray, n_activities: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sum up the counts of equal (node, activity) pairs, sorted by node."""
+    n_activities = max(n_activities, 1)
+    keys, inverse = np.unique(nodes * n_activities + activities, return_inverse=True)
+    summed = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(keys))
+    return keys // n_activities, keys % n_activities, summed.astype(np.int64)
@@ -22,6 +22,66 @@ REFRESH_TOKEN_EXPIRY_TIME = datetime.timedelta(days=30)
 
 DATE_FMT = "%Y-%m-%dT%H:%M:%SZ"
 
+# Which engine answers location bbox queries:
+# "mongo" queries the `simple_locations` collection directly,
+# "memory" uses an in-process spatial index, which is built on startup.
+# Until the index is built, the "memory" engine falls back to mongo.
+LOCATION_ENGINE_MONGO = "mongo"
+LOCATION_ENGINE_MEMORY = "memory"
+LOCATION_QUERY_ENGINE = os.getenv("LOCATION_QUERY_ENGINE", LOCATION_ENGINE_MONGO)
+if LOCATION_QUERY_ENGINE not in [LOCATION_ENGINE_MONGO, LOCATION_ENGINE_MEMORY]:
+    raise Exception(f"Unknown location query engine {LOCATION_QUERY_ENGINE}!")
+
+# How the `simple_locations` collection is kept in sync with `locations`:
+# "dual_write" writes both collections in the request handlers,
+# "change_stream" lets a background projector follow the changes of `locations`.
+# Change streams need mongo to run as a replica set (a single node is enough).
+SHORT_SYNC_DUAL_WRITE = "dual_write"
+SHORT_SYNC_CHANGE_STREAM = "change_stream"
+SHORT_LOCATION_SYNC = os.getenv("SHORT_LOCATION_SYNC", SHORT_SYNC_DUAL_WRITE)
+if SHORT_LOCATION_SYNC not in [SHORT_SYNC_DUAL_WRITE, SHORT_SYNC_CHANGE_STREAM]:
+    raise Exception(f"Unknown short location sync mode {SHORT_LOCATION_SYNC}!")
+
+# Number of grid tiles the bbox query cache keeps in memory, 0 disables the cache.
+# Only writes of this process invalidate cached tiles, writes of other workers or
+# tools show up once the entries expire after BBOX_CACHE_TTL seconds.
+BBOX_CACHE_SIZE = int(os.getenv("BBOX_CACHE_SIZE", 0))
+BBOX_CACHE_TTL = float(os.getenv("BBOX_CACHE_TTL", 60))
+
+# Minimal seconds between reloads of the points of the map clusterings after
+# locations changed, the outdated ones are served in the meantime. Only changes
+# this process sees count, i.e. its own writes and those of the projector.
+CLUSTERING_REFRESH_INTERVAL = float(os.getenv("CLUSTERING_REFRESH_INTERVAL", 60))
+
+# default and maximal page size of the offers of a user
+OFFERS_PAGE_SIZE = int(os.getenv("OFFERS_PAGE_SIZE", 20))
+OFFERS_MAX_PAGE_SIZE = int(os.getenv("OFFERS_MAX_PAGE_SIZE", 100))
+
+# Seconds between the runs of the sweeper that times out expired offers, 0 disables it
+OFFER_EXPIRY_INTERVAL = float(os.getenv("OFFER_EXPIRY_INTERVAL", 60))
+
+# Whether `/locations/search` is answered by an in-process prefix index over names
+# and some tags, built on startup. Without it only name prefixes are searched.
+LOCATION_SEARCH_INDEX = os.getenv("LOCATION_SEARCH_INDEX", "true").lower() == "true"
+
+# What happens if a new location looks like a duplicate of an existing one:
+# "warn" adds it and returns the possible duplicates, "reject" refuses to add it
+# (unless the client insists), "off" skips the check.
+DUPLICATE_POLICY_WARN = "warn"
+DUPLICATE_POLICY_REJECT = "reject"
+DUPLICATE_POLICY_OFF = "off"
+DUPLICATE_POLICY = os.getenv("DUPLICATE_POLICY", DUPLICATE_POLICY_WARN)
+if DUPLICATE_POLICY not in [
+    DUPLICATE_POLICY_WARN,
+    DUPLICATE_POLICY_REJECT,
+    DUPLICATE_POLICY_OFF,
+]:
+    raise Exception(f"Unknown duplicate policy {DUPLICATE_POLICY}!")
+
+# Entries per page of a location's update history, clients can ask for up to the max
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 10))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 100))
+
 
 class Email:
     SMTP_SERVER = get_env_or_throw("MAIL_SERVER")
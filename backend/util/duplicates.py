@@ -0,0 +1,81 @@
+import math
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Iterable
+
+from backend.util.geodesic import EARTH_RADIUS
+
+# locations further apart than this are never considered duplicates
+DUPLICATE_RADIUS = 50  # meters
+# minimal score for a pair of locations to count as possible duplicate
+DUPLICATE_THRESHOLD = 0.6
+
+# weights of the single similarities in the score, summing up to 1
+DISTANCE_WEIGHT = 0.4
+ACTIVITY_WEIGHT = 0.4
+NAME_WEIGHT = 0.2
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_name(name: str | None) -> str:
+    """Lower case, without accents, punctuation and repeated whitespace."""
+    if not name:
+        return ""
+
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return _NON_WORD.sub(" ", name.casefold()).strip()
+
+
+def name_similarity(a: str | None, b: str | None) -> float | None:
+    """Similarity in [0, 1] of the normalized names, None if a name is missing."""
+    a, b = normalize_name(a), normalize_name(b)
+    if not a or not b:
+        return None
+
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def activity_overlap(a: Iterable[str], b: Iterable[str]) -> float:
+    """Jaccard similarity of the activity types."""
+    a, b = set(a), set(b)
+    if not a or not b:
+        return 0
+
+    return len(a & b) / len(a | b)
+
+
+def duplicate_score(
+    distance: float,
+    activities_a: Iterable[str],
+    activities_b: Iterable[str],
+    name_a: str | None,
+    name_b: str | None,
+    radius: float = DUPLICATE_RADIUS,
+) -> float:
+    """
+    Likelihood in [0, 1] that two locations `distance` meters apart are the same.
+    A missing name neither counts for nor against a duplicate.
+    """
+    if distance > radius:
+        return 0
+
+    score = DISTANCE_WEIGHT * (1 - distance / radius)
+    score += ACTIVITY_WEIGHT * activity_overlap(activities_a, activities_b)
+
+    names = name_similarity(name_a, name_b)
+    if names is None:
+        return score / (1 - NAME_WEIGHT)
+
+    return score + NAME_WEIGHT * names
+
+
+def radius_in_degrees(
+    lat: float, radius: float = DUPLICATE_RADIUS
+) -> tuple[float, float]:
+    """Longitude and latitude span covering `radius` meters around the latitude."""
+    d_lat = math.degrees(radius / EARTH_RADIUS)
+    cos_lat = max(math.cos(math.radians(min(abs(lat) + d_lat, 90))), 1e-6)
+    return min(d_lat / cos_lat, 180), d_lat
@@ -124,6 +124,12 @@ class LocationDoesNotExist(Exception):
     ...
 
 
+class LocationPossibleDuplicate(Exception):
+    def __init__(self, duplicates) -> None:
+        super().__init__()
+        self.duplicates = duplicates
+
+
 class InvalidUpdateType(Exception):
     ...
 
@@ -136,6 +142,16 @@ class InvalidBeforeData(Exception):
     ...
 
 
+class LocationUpdateConflict(Exception):
+    def __init__(self, version: int) -> None:
+        super().__init__()
+        self.version = version
+
+
+class InvalidCursor(Exception):
+    ...
+
+
 class TagExists(Exception):
     ...
 
@@ -156,6 +172,18 @@ class UserDoesNotOwnOffer(Exception):
     ...
 
 
+class OfferIsNotOpen(Exception):
+    ...
+
+
+class OfferIsFull(Exception):
+    ...
+
+
+class OfferUpdateConflict(Exception):
+    ...
+
+
 class PhotoDoesNotExist(Exception):
     ...
 
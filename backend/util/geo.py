@@ -0,0 +1,79 @@
+import math
+from typing import Any
+
+from backend.util.types import BoundingBox
+
+# Edges of 2dsphere polygons are great circle arcs, not lines of constant latitude.
+# The edges of a box are split into steps of at most this many degrees, so the
+# polygon doesn't deviate noticeably from the box.
+MAX_EDGE_DEGREES = 1.0
+# Polygons have to be smaller than a hemisphere, wider boxes are split up
+MAX_POLYGON_WIDTH = 90.0
+# the poles would turn the north or south edge into a single point
+MAX_LATITUDE = 89.999999
+# boxes get at least this extent in degrees
+MIN_EXTENT = 1e-9
+
+
+def crosses_antimeridian(bbox: BoundingBox) -> bool:
+    (west, _), (east, _) = bbox
+    return west > east
+
+
+def split_antimeridian(bbox: BoundingBox) -> list[BoundingBox]:
+    """
+    A box with west > east wraps around the antimeridian, return it as the two
+    boxes on either side of it. Other boxes are returned unchanged.
+    """
+    if not crosses_antimeridian(bbox):
+        return [bbox]
+
+    (west, south), (east, north) = bbox
+    return [((west, south), (180.0, north)), ((-180.0, south), (east, north))]
+
+
+def _steps(start: float, end: float) -> list[float]:
+    """`start`, intermediate values at most MAX_EDGE_DEGREES apart, and `end`."""
+    n = max(1, math.ceil((end - start) / MAX_EDGE_DEGREES))
+    return [start + (end - start) * i / n for i in range(n + 1)]
+
+
+def _box_ring(
+    west: float, south: float, east: float, north: float
+) -> list[list[float]]:
+    """Counterclockwise ring with densified edges."""
+    longs = _steps(west, east)
+    lats = _steps(south, north)
+    ring = [[long, south] for long in longs]
+    ring += [[east, lat] for lat in lats[1:]]
+    ring += [[long, north] for long in reversed(longs[:-1])]
+    ring += [[west, lat] for lat in reversed(lats[:-1])]
+    return ring
+
+
+def bbox_to_geometry(bbox: BoundingBox) -> dict[str, Any]:
+    """
+    GeoJSON (Multi)Polygon covering the bbox on the sphere, for `$geoWithin`
+    queries on 2dsphere indexes. Boxes crossing the antimeridian (west > east)
+    are split at it.
+    """
+    polygons = []
+    for (west, south), (east, north) in split_antimeridian(bbox):
+        west, east = max(west, -180.0), min(east, 180.0)
+        south, north = max(south, -MAX_LATITUDE), min(north, MAX_LATITUDE)
+        # degenerate boxes are no valid polygons
+        east = max(east, west + MIN_EXTENT)
+        north = max(north, south + MIN_EXTENT)
+
+        longs = [west]
+        while longs[-1] + MAX_POLYGON_WIDTH < east:
+            longs.append(longs[-1] + MAX_POLYGON_WIDTH)
+        longs.append(east)
+
+        for w, e in zip(longs, longs[1:]):
+            polygons.append([_box_ring(w, south, e, north)])
+
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+
+    return {"type": "MultiPolygon", "coordinates": polygons}
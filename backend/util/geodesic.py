@@ -0,0 +1,57 @@
+import math
+from typing import Iterable
+
+import numpy as np
+from numpy.typing import ArrayLike
+
+EARTH_RADIUS = 6_371_000  # meters, mean radius of the earth
+
+# The haversine distances are on a sphere with the mean radius, they differ from
+# distances on the WGS84 ellipsoid by at most about 0.5%, which is plenty for
+# radius filters and ranking.
+
+
+def distance(a: Iterable[float], b: Iterable[float]) -> float:
+    """Great circle distance in meters between two long/lat points."""
+    (long1, lat1), (long2, lat2) = a, b
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(long2 - long1)
+    h = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(h)))
+
+
+def _radians(points: ArrayLike) -> tuple[np.ndarray, np.ndarray]:
+    """Longitudes and latitudes in radians of long/lat points of shape (..., 2)."""
+    points = np.radians(np.asarray(points, dtype=np.float64))
+    return points[..., 0], points[..., 1]
+
+
+def distances(a: ArrayLike, b: ArrayLike) -> np.ndarray:
+    """
+    Great circle distances in meters between long/lat points of shape (..., 2).
+    The shapes are broadcast, e.g. one point against an (n, 2) array of points.
+    """
+    lambda1, phi1 = _radians(a)
+    lambda2, phi2 = _radians(b)
+    h = (
+        np.sin((phi2 - phi1) / 2) ** 2
+        + np.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(1, np.sqrt(h)))
+
+
+def bearings(a: ArrayLike, b: ArrayLike) -> np.ndarray:
+    """
+    Initial bearings in degrees, clockwise from north in [0, 360), of the great
+    circles from the points `a` to the points `b`. Broadcast like `distances`.
+    """
+    lambda1, phi1 = _radians(a)
+    lambda2, phi2 = _radians(b)
+    d_lambda = lambda2 - lambda1
+    y = np.sin(d_lambda) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(d_lambda)
+    return np.degrees(np.arctan2(y, x)) % 360
@@ -0,0 +1,52 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from backend.util import errors
+
+# A cursor points behind the last entry of a page, by the value of the sort field
+# and the id of that entry (to break ties of the sort field).
+Cursor = tuple[datetime, ObjectId]
+
+
+def encode_cursor(value: datetime, id: ObjectId) -> str:
+    """Opaque, url safe version of the cursor."""
+    raw = json.dumps([value.isoformat(), str(id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, id = json.loads(raw)
+        return datetime.fromisoformat(value), ObjectId(id)
+    except (binascii.Error, ValueError, TypeError, InvalidId):
+        raise errors.InvalidCursor()
+
+
+def keyset_filter(field: str, cursor: Cursor, descending: bool = True):
+    """
+    Mongo filter for all entries after the cursor, when sorting by `field` and
+    `_id` in the given direction. With an index on both it is answered by seeking
+    the index, no matter how deep the page is.
+    """
+    value, id = cursor
+    op = "$lt" if descending else "$gt"
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: id}}]}
+
+
+def page_of(docs: list[Any], size: int, cursor_of) -> tuple[list[Any], str | None]:
+    """
+    Split the `size + 1` fetched docs into the page and the cursor of the next
+    page, which is None on the last page.
+    """
+    if len(docs) <= size:
+        return docs, None
+
+    docs = docs[:size]
+    return docs, encode_cursor(*cursor_of(docs[-1]))
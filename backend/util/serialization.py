@@ -0,0 +1,45 @@
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any
+
+from bson import ObjectId
+from fastapi import Response
+
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> str:
+    """JSON encode raw mongo documents, the same way pydantic models would be."""
+    return json.dumps(content, default=_default, separators=(",", ":"))
+
+
+def projection_for(model) -> dict[str, int]:
+    """Mongo projection of all fields of the given API model."""
+    return {name: 1 for name in model.__fields__ if name != "id"}
+
+
+def to_api_doc(doc: dict[str, Any]) -> dict[str, Any]:
+    """Rename a raw document's `_id` to the `id` our API models use."""
+    doc["id"] = doc.pop("_id")
+    return doc
+
+
+class RawJsonResponse(Response):
+    """
+    Response for raw documents that are trusted to match the response model.
+    Skips FastAPI's validation and encoding of the content.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content).encode("utf-8")
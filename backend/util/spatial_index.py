@@ -0,0 +1,96 @@
+import math
+from typing import Callable, Generic, Hashable, Iterator, TypeVar
+
+from backend.util.types import BoundingBox
+
+T = TypeVar("T")
+
+# cell edge length in degrees, roughly 11km at the equator
+DEFAULT_CELL_SIZE = 0.1
+
+Cell = tuple[int, int]
+
+
+class GridIndex(Generic[T]):
+    """
+    In-memory uniform grid over long/lat points.
+
+    Every item is stored in the cell its point falls into, so a bounding box
+    query only has to look at the cells overlapping the box instead of all points.
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE) -> None:
+        self.cell_size = cell_size
+        self._cells: dict[Cell, dict[Hashable, tuple[float, float, T]]] = {}
+        self._cell_of: dict[Hashable, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self._cell_of)
+
+    def __contains__(self, id: Hashable) -> bool:
+        return id in self._cell_of
+
+    def get(self, id: Hashable) -> T | None:
+        cell = self._cell_of.get(id)
+        return None if cell is None else self._cells[cell][id][2]
+
+    def values(self) -> Iterator[T]:
+        for entries in self._cells.values():
+            for _, _, item in entries.values():
+                yield item
+
+    def _cell(self, long: float, lat: float) -> Cell:
+        return math.floor(long / self.cell_size), math.floor(lat / self.cell_size)
+
+    def insert(self, id: Hashable, long: float, lat: float, item: T):
+        """Insert the item or replace it, if an item with the same id exists."""
+        self.remove(id)
+
+        cell = self._cell(long, lat)
+        self._cells.setdefault(cell, {})[id] = (long, lat, item)
+        self._cell_of[id] = cell
+
+    def remove(self, id: Hashable) -> bool:
+        cell = self._cell_of.pop(id, None)
+        if cell is None:
+            return False
+
+        entries = self._cells[cell]
+        del entries[id]
+        if not entries:
+            del self._cells[cell]
+
+        return True
+
+    def _cells_in(self, bbox: BoundingBox) -> Iterator[Cell]:
+        (west, south), (east, north) = bbox
+        x0, y0 = self._cell(west, south)
+        x1, y1 = self._cell(east, north)
+
+        # For huge boxes it's cheaper to check the occupied cells only
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self._cells):
+            for cell in self._cells:
+                if x0 <= cell[0] <= x1 and y0 <= cell[1] <= y1:
+                    yield cell
+            return
+
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                if (x, y) in self._cells:
+                    yield (x, y)
+
+    def query(
+        self, bbox: BoundingBox, predicate: Callable[[T], bool] | None = None
+    ) -> list[T]:
+        """Return all items inside the bbox (borders included) matching `predicate`."""
+        (west, south), (east, north) = bbox
+        result = []
+        for cell in self._cells_in(bbox):
+            for long, lat, item in self._cells[cell].values():
+                if not (west <= long <= east and south <= lat <= north):
+                    continue
+                if predicate is not None and not predicate(item):
+                    continue
+                result.append(item)
+
+        return result
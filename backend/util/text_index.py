@@ -0,0 +1,174 @@
+import bisect
+import heapq
+from typing import Callable, Generic, Hashable, Iterable, TypeVar
+
+from backend.util.duplicates import normalize_name
+
+T = TypeVar("T")
+
+# weight of a match in the whole text compared to a match in one of its tokens
+FULL_PREFIX_BONUS = 1.0
+# an exact token match ranks above a match of the token's prefix
+EXACT_TOKEN_BONUS = 0.5
+
+
+def tokenize(text: str | None) -> list[str]:
+    return normalize_name(text).split()
+
+
+class PrefixIndex(Generic[T]):
+    """
+    In-memory inverted index for autocomplete over short texts like names.
+
+    Every item is indexed by the normalized tokens of its weighted texts. The
+    tokens are kept sorted, so all tokens starting with a prefix are found by
+    bisecting. A query matches items that have a token starting with every
+    query token, ranked by the weights of the texts the tokens were found in.
+    """
+
+    def __init__(self) -> None:
+        # token -> id -> best weight of a text containing the token
+        self._postings: dict[str, dict[Hashable, float]] = {}
+        self._entries: dict[Hashable, tuple[str, float, T]] = {}
+        self._tokens_of: dict[Hashable, set[str]] = {}
+        self._sorted: list[str] = []
+        self._dirty = False
+        self._max_weight = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, id: Hashable) -> bool:
+        return id in self._entries
+
+    def insert(self, id: Hashable, texts: Iterable[tuple[str | None, float]], item: T):
+        """
+        Index the item by the (text, weight) pairs, the first text is the main
+        one (e.g. the name) and gets a bonus if it starts with the whole query.
+        Replaces the item with the same id, if there is one.
+        """
+        self.remove(id)
+
+        texts = list(texts)
+        tokens: dict[str, float] = {}
+        for text, weight in texts:
+            for token in tokenize(text):
+                tokens[token] = max(weight, tokens.get(token, 0))
+
+        if not tokens:
+            return
+
+        self._max_weight = max(self._max_weight, *tokens.values())
+        for token, weight in tokens.items():
+            postings = self._postings.setdefault(token, {})
+            if not postings:
+                self._dirty = True
+            postings[id] = weight
+
+        main, main_weight = texts[0]
+        self._entries[id] = (normalize_name(main), main_weight, item)
+        self._tokens_of[id] = set(tokens)
+
+    def remove(self, id: Hashable) -> bool:
+        if self._entries.pop(id, None) is None:
+            return False
+
+        for token in self._tokens_of.pop(id):
+            postings = self._postings[token]
+            del postings[id]
+            if not postings:
+                del self._postings[token]
+                self._dirty = True
+
+        return True
+
+    def _tokens_with_prefix(self, prefix: str) -> list[str]:
+        if self._dirty:
+            self._sorted = sorted(self._postings)
+            self._dirty = False
+
+        start = bisect.bisect_left(self._sorted, prefix)
+        end = bisect.bisect_left(self._sorted, prefix + "\uffff", lo=start)
+        return self._sorted[start:end]
+
+    def _score(self, id: Hashable, prefixes: list[str]) -> float | None:
+        """Sum of the best matching token per prefix, None if a prefix has none."""
+        tokens = self._tokens_of[id]
+        score = 0.0
+        for prefix in prefixes:
+            best = None
+            for token in tokens:
+                if token.startswith(prefix):
+                    weight = self._postings[token][id]
+                    if token == prefix:
+                        weight += EXACT_TOKEN_BONUS
+                    if best is None or weight > best:
+                        best = weight
+            if best is None:
+                return None
+            score += best
+
+        return score
+
+    def search(
+        self,
+        query: str,
+        predicate: Callable[[T], bool] | None = None,
+        limit: int = 20,
+    ) -> list[tuple[float, T]]:
+        """Best `limit` items matching all query tokens, as (score, item)."""
+        prefixes = tokenize(query)
+        if not prefixes or limit <= 0:
+            return []
+
+        # Candidates come from the most selective prefix, the others are checked
+        # on the tokens of each candidate.
+        tokens = {p: self._tokens_with_prefix(p) for p in prefixes}
+        driver = min(
+            prefixes, key=lambda p: sum(len(self._postings[t]) for t in tokens[p])
+        )
+        # exact matches first, they are likely to rank best
+        driver_tokens = sorted(tokens[driver], key=lambda t: t != driver)
+
+        # highest possible score, once the best `limit` items reach it, no other
+        # item can beat them
+        best_possible = self._max_weight * (len(prefixes) + FULL_PREFIX_BONUS) + sum(
+            EXACT_TOKEN_BONUS for p in prefixes if p in self._postings
+        )
+
+        full = normalize_name(query)
+        heap: list[tuple[float, int, T]] = []
+        seen: set[Hashable] = set()
+        for token in driver_tokens:
+            for id in self._postings[token]:
+                if id in seen:
+                    continue
+                seen.add(id)
+
+                score = self._score(id, prefixes)
+                if score is None:
+                    continue
+
+                main, main_weight, item = self._entries[id]
+                if main.startswith(full):
+                    score += FULL_PREFIX_BONUS * main_weight
+                if len(heap) == limit and score <= heap[0][0]:
+                    continue
+                if predicate is not None and not predicate(item):
+                    continue
+
+                # the counter keeps items from being compared on equal scores
+                entry = (score, len(seen), item)
+                if len(heap) < limit:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heapreplace(heap, entry)
+
+                if len(heap) == limit and heap[0][0] >= best_possible:
+                    return _ranked(heap)
+
+        return _ranked(heap)
+
+
+def _ranked(heap: list[tuple[float, int, T]]) -> list[tuple[float, T]]:
+    return [(score, item) for score, _, item in sorted(heap, key=lambda e: -e[0])]
@@ -0,0 +1,139 @@
+"""
+Packed binary map tiles for locations.
+
+A tile covers the slippy map tile `z/x/y` and is laid out like this, with all
+integers encoded as unsigned LEB128 varints:
+
+    magic           b"ART1"
+    n_strings       followed by n_strings * (byte length, utf-8 bytes)
+    n_locations     followed by n_locations * location
+
+    location:
+        id delta    ObjectId as 96 bit integer, minus the id before it (or 0)
+        x, y        position inside the tile, quantized to [0, TILE_EXTENT)
+        n           followed by n string table indices for the activity types
+
+Locations are sorted by id, so the id deltas stay small.
+"""
+
+import math
+from typing import Iterable
+
+from beanie import PydanticObjectId
+
+from backend.util.clustering import project
+from backend.util.types import BoundingBox
+
+MAGIC = b"ART1"
+TILE_EXTENT = 4096
+MIN_TILE_ZOOM = 10
+MAX_TILE_ZOOM = 22
+MEDIA_TYPE = "application/vnd.activityradar.tile"
+
+TileLocation = tuple[PydanticObjectId, float, float, list[str]]
+
+
+def tile_bbox(z: int, x: int, y: int) -> BoundingBox:
+    n = 2**z
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return (x / n * 360 - 180, lat(y + 1)), ((x + 1) / n * 360 - 180, lat(y))
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_tile(z: int, x: int, y: int, locations: Iterable[TileLocation]) -> bytes:
+    """
+    Encode (id, long, lat, activity_types) tuples into a tile. Locations outside
+    the tile are skipped, so ones on the border end up in exactly one tile.
+    """
+    n = 2**z
+    strings: dict[str, int] = {}
+    rows = []
+    for id, long, lat, activities in locations:
+        px, py = project(long, lat)
+        qx = math.floor((px * n - x) * TILE_EXTENT)
+        qy = math.floor((py * n - y) * TILE_EXTENT)
+        if not (0 <= qx < TILE_EXTENT and 0 <= qy < TILE_EXTENT):
+            continue
+
+        indices = [strings.setdefault(a, len(strings)) for a in activities]
+        rows.append((int(str(id), 16), qx, qy, indices))
+
+    rows.sort()
+
+    out = bytearray(MAGIC)
+    _write_varint(out, len(strings))
+    for s in strings:  # dicts keep the insertion order, which is the index
+        encoded = s.encode()
+        _write_varint(out, len(encoded))
+        out += encoded
+
+    _write_varint(out, len(rows))
+    last_id = 0
+    for id, qx, qy, indices in rows:
+        _write_varint(out, id - last_id)
+        last_id = id
+        _write_varint(out, qx)
+        _write_varint(out, qy)
+        _write_varint(out, len(indices))
+        for i in indices:
+            _write_varint(out, i)
+
+    return bytes(out)
+
+
+def decode_tile(z: int, x: int, y: int, data: bytes) -> list[TileLocation]:
+    """Inverse of `encode_tile`, up to the quantization of the coordinates."""
+    if data[:4] != MAGIC:
+        raise ValueError("Not a location tile!")
+
+    pos = 4
+    n_strings, pos = _read_varint(data, pos)
+    strings = []
+    for _ in range(n_strings):
+        length, pos = _read_varint(data, pos)
+        strings.append(data[pos : pos + length].decode())
+        pos += length
+
+    n = 2**z
+    n_rows, pos = _read_varint(data, pos)
+    result = []
+    id = 0
+    for _ in range(n_rows):
+        delta, pos = _read_varint(data, pos)
+        id += delta
+        qx, pos = _read_varint(data, pos)
+        qy, pos = _read_varint(data, pos)
+        n_activities, pos = _read_varint(data, pos)
+        activities = []
+        for _ in range(n_activities):
+            i, pos = _read_varint(data, pos)
+            activities.append(strings[i])
+
+        # use the center of the quantization cell
+        px = (x + (qx + 0.5) / TILE_EXTENT) / n
+        py = (y + (qy + 0.5) / TILE_EXTENT) / n
+        long = px * 360 - 180
+        lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py))))
+        result.append((PydanticObjectId(f"{id:024x}"), long, lat, activities))
+
+    return result
@@ -0,0 +1,108 @@
+"""
+Write cost and storage of the location geo indexes, with and without the 2d index.
+
+Two scratch collections are filled with the same short locations, one with the
+2dsphere index only, one with the additional legacy 2d index on the coordinates.
+Then a part of the locations is moved. Insert and update throughput and the
+index sizes are reported. Needs a running mongo (the one configured in `.env`);
+the scratch collections are dropped afterwards.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from bson import ObjectId
+from pymongo import GEO2D, GEOSPHERE, IndexModel, UpdateOne
+
+sys.path.append(".")
+
+from backend.database.connection import client
+from backend.util import constants
+
+ACTIVITIES = ["soccer", "tennis", "basketball", "table_tennis", "climbing"]
+
+GEOSPHERE_INDEX = IndexModel([("location", GEOSPHERE)], name="location_index_GEOSPHERE")
+GEO2D_INDEX = IndexModel([("location.coordinates", GEO2D)], name="location_index_GEO2D")
+
+
+def random_coordinates():
+    return [random.uniform(5.8, 15), random.uniform(47, 55)]
+
+
+def short_location_doc():
+    return {
+        "_id": ObjectId(),
+        "activity_types": random.sample(ACTIVITIES, 2),
+        "location": {"type": "Point", "coordinates": random_coordinates()},
+        "name": "Sportplatz",
+        "trust_score": 1000,
+        "average_rating": 3.5,
+    }
+
+
+async def measure(db, name, indexes, docs, moves, batch_size):
+    collection = db[f"benchmark_geo_indexes_{name}"]
+    await collection.drop()
+    await collection.create_indexes(indexes)
+
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(docs), batch_size):
+            await collection.insert_many(docs[i : i + batch_size], ordered=False)
+        inserts = len(docs) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(0, len(moves), batch_size):
+            await collection.bulk_write(moves[i : i + batch_size], ordered=False)
+        updates = len(moves) / (time.perf_counter() - start)
+
+        stats = await db.command("collStats", collection.name)
+        index_sizes = stats["indexSizes"]
+    finally:
+        await collection.drop()
+
+    geo_size = sum(size for index, size in index_sizes.items() if index != "_id_")
+    print(
+        f"{name:<14} inserts: {inserts:9.0f}/s   moves: {updates:9.0f}/s"
+        f"   geo index size: {geo_size / 2**20:7.1f} MiB"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares writes with and without the legacy 2d index"
+    )
+    parser.add_argument("-n", help="Locations to insert", type=int, default=200_000)
+    parser.add_argument(
+        "--moves", help="Locations to move afterwards", type=int, default=50_000
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    db = client[constants.DATABASE_NAME]
+
+    random.seed(0)
+    docs = [short_location_doc() for _ in range(args.n)]
+    moves = [
+        UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"location.coordinates": random_coordinates()}},
+        )
+        for doc in random.sample(docs, min(args.moves, args.n))
+    ]
+
+    for name, indexes in [
+        ("2dsphere", [GEOSPHERE_INDEX]),
+        ("2dsphere+2d", [GEOSPHERE_INDEX, GEO2D_INDEX]),
+    ]:
+        await measure(db, name, indexes, docs, moves, args.batch_size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
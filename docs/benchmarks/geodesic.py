@@ -0,0 +1,92 @@
+"""
+Batched distances with `backend.util.geodesic` compared to one geopy call per pair.
+
+Distances and bearings from one center to generated candidates around it are
+computed with the NumPy kernel and per item with geopy's great circle and
+geodesic (WGS84) distances. Reports the time per batch and the largest relative
+error of the kernel against the ellipsoidal distances. No database is needed,
+but geopy has to be installed (`pip install geopy`), it's not a dependency of
+the backend.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+from geopy import distance as geo_distance
+
+sys.path.append(".")
+
+from backend.util.geodesic import bearings, distance, distances
+
+CENTER = (8.5, 47.35)
+
+
+def best_of(repeat: int, f) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares batched haversine distances with per item geopy calls"
+    )
+    parser.add_argument("-n", help="Candidates per batch", type=int, default=10_000)
+    parser.add_argument("--radius", help="Spread in degrees", type=float, default=1.0)
+    parser.add_argument("--repeat", help="Best of so many runs", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(0)
+    points = [
+        (
+            CENTER[0] + random.uniform(-args.radius, args.radius),
+            CENTER[1] + random.uniform(-args.radius, args.radius),
+        )
+        for _ in range(args.n)
+    ]
+    # geopy takes lat/long
+    center_latlong = CENTER[::-1]
+    points_latlong = [(lat, long) for long, lat in points]
+
+    def geopy_great_circle():
+        return [geo_distance.great_circle(center_latlong, p).m for p in points_latlong]
+
+    def geopy_geodesic():
+        return [geo_distance.geodesic(center_latlong, p).m for p in points_latlong]
+
+    def scalar():
+        return [distance(CENTER, p) for p in points]
+
+    def batched():
+        return distances(CENTER, np.asarray(points))
+
+    def batched_with_bearings():
+        array = np.asarray(points)
+        return distances(CENTER, array), bearings(CENTER, array)
+
+    print(f"{args.n} candidates")
+    for name, f in [
+        ("geopy geodesic", geopy_geodesic),
+        ("geopy great circle", geopy_great_circle),
+        ("math haversine", scalar),
+        ("numpy haversine", batched),
+        ("numpy + bearings", batched_with_bearings),
+    ]:
+        print(f"{name:<20} {best_of(args.repeat, f) * 1000:9.2f} ms")
+
+    exact = np.asarray(geopy_geodesic())
+    error = np.abs(batched() - exact) / np.maximum(exact, 1)
+    print(f"max relative error vs geodesic: {error.max():.4%}")
+
+
+if __name__ == "__main__":
+    main()
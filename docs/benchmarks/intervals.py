@@ -0,0 +1,65 @@
+from typing import Generic, Iterable, Iterator, TypeVar
+
+# comparable bounds of the intervals, e.g. datetimes
+S = TypeVar("S")
+T = TypeVar("T")
+
+
+class IntervalIndex(Generic[S, T]):
+    """
+    Static interval tree over closed intervals [start, end], e.g. of datetimes.
+
+    The intervals are sorted by start and form an implicit balanced search tree,
+    the middle of every range being the root of its subtree. Each root knows the
+    largest end in its subtree, so subtrees ending before a query are skipped.
+    Building takes O(n log n), finding the k intervals overlapping a query
+    O(log n + k log n).
+    """
+
+    def __init__(self, intervals: Iterable[tuple[S, S, T]]) -> None:
+        entries = sorted(intervals, key=lambda e: e[0])
+        self._starts = [start for start, _, _ in entries]
+        self._ends = [end for _, end, _ in entries]
+        self._items = [item for _, _, item in entries]
+        # largest end in the subtree rooted at an index
+        self._max_ends = list(self._ends)
+        if entries:
+            self._build(0, len(entries))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _build(self, lo: int, hi: int) -> S:
+        mid = (lo + hi) // 2
+        max_end = self._ends[mid]
+        if lo < mid:
+            max_end = max(max_end, self._build(lo, mid))
+        if mid + 1 < hi:
+            max_end = max(max_end, self._build(mid + 1, hi))
+
+        self._max_ends[mid] = max_end
+        return max_end
+
+    def overlapping(self, start: S, end: S) -> Iterator[T]:
+        """Items of the intervals overlapping [start, end], ordered by start."""
+        yield from self._overlapping(0, len(self._items), start, end)
+
+    def _overlapping(self, lo: int, hi: int, start: S, end: S) -> Iterator[T]:
+        if lo >= hi:
+            return
+
+        mid = (lo + hi) // 2
+        if self._max_ends[mid] < start:
+            return  # everything in the subtree ends before the query
+
+        yield from self._overlapping(lo, mid, start, end)
+        if end < self._starts[mid]:
+            return  # the root and its right subtree start after the query
+
+        if not self._ends[mid] < start:
+            yield self._items[mid]
+        yield from self._overlapping(mid + 1, hi, start, end)
+
+    def overlapping_many(self, windows: Iterable[tuple[S, S]]) -> list[list[T]]:
+        """The items overlapping each of the windows."""
+        return [list(self.overlapping(start, end)) for start, end in windows]
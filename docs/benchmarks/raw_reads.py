@@ -0,0 +1,177 @@
+"""
+Per-document cost of the validated and the raw read path.
+
+The validated path parses every document into the beanie model, copies it into
+the API model and lets FastAPI validate and encode the response. The raw path
+takes the projected document as it comes from motor and encodes it directly.
+Documents are generated in memory, so only the CPU cost is compared, not the
+time spent in the database.
+"""
+
+import argparse
+import asyncio
+import copy
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from beanie.odm.utils.parsing import parse_obj
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+sys.path.append(".")
+
+from backend.database.connection import init as init_db
+from backend.database.models.locations import (
+    LocationDetailedApi,
+    LocationDetailedDb,
+    LocationShortApi,
+    LocationShortDb,
+)
+from backend.database.models.offers import Offer, OfferOut
+from backend.util.serialization import RawJsonResponse, projection_for, to_api_doc
+
+ACTIVITIES = ["soccer", "tennis", "basketball", "table_tennis", "climbing"]
+
+
+def random_point():
+    return {
+        "type": "Point",
+        "coordinates": [random.uniform(5.8, 15), random.uniform(47, 55)],
+    }
+
+
+def short_location_doc():
+    return {
+        "_id": ObjectId(),
+        "activity_types": random.sample(ACTIVITIES, 2),
+        "location": random_point(),
+        "name": "Sportplatz",
+        "trust_score": 1000,
+        "average_rating": 3.5,
+    }
+
+
+def detailed_location_doc():
+    now = datetime.utcnow()
+    review = {
+        "id": ObjectId(),
+        "location_id": ObjectId(),
+        "user_id": ObjectId(),
+        "description": {"title": "Nice", "text": "Good surface, a bit crowded."},
+        "overall_rating": 4.0,
+        "details": {},
+        "creation_date": now,
+    }
+    return {
+        "_id": ObjectId(),
+        "activity_types": random.sample(ACTIVITIES, 2),
+        "location": random_point(),
+        "name": "Sportplatz",
+        "trust_score": 1000,
+        "tags": {"leisure": "pitch", "surface": "grass", "lit": "yes"},
+        "geometry": None,
+        "photos": [],
+        "reviews": {"average_rating": 4.0, "count": 3, "recent": [review] * 3},
+        "creation": {"created_by": "OSM", "date": now, "user_id": None},
+        "last_modified": now,
+        "osm_id": random.randint(1, 10**9),
+    }
+
+
+def offer_doc():
+    now = datetime.utcnow()
+    user_id = ObjectId()
+    return {
+        "_id": ObjectId(),
+        "activity": random.sample(ACTIVITIES, 1),
+        "time": {"type": "single", "times": [now, now + timedelta(hours=2)]},
+        "description": {"title": "Anyone up for a match?", "text": "Bring a ball."},
+        "visibility": "public",
+        "visibility_radius": 5.0,
+        "location": {"coords": random_point()},
+        "participant_limits": [2, 4],
+        "participants": [{"id": user_id, "status": "host"}],
+        "creation_date": now,
+        "user_info": {"id": user_id, "username": "user", "display_name": "User"},
+        "blurr_info": {"radius": 1.0, "center": random_point()},
+        "status": "open",
+    }
+
+
+async def validated_path(docs, db_model, api_model) -> bytes:
+    models = [parse_obj(db_model, doc) for doc in docs]
+    result = [api_model(**m.dict()) for m in models]
+    field = create_response_field("Response", list[api_model])
+    content = await serialize_response(field=field, response_content=result)
+    return JSONResponse(content).body
+
+
+async def raw_path(docs) -> bytes:
+    return RawJsonResponse([to_api_doc(doc) for doc in docs]).body
+
+
+async def measure(name, make_doc, db_model, api_model, n, repeat):
+    docs = [make_doc() for _ in range(n)]
+    # the projection happens in mongo, so it is not part of the measurement
+    projection = projection_for(api_model)
+    projected = [
+        {k: v for k, v in doc.items() if k == "_id" or k in projection} for doc in docs
+    ]
+
+    validated = raw = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await validated_path(docs, db_model, api_model)
+        validated = min(validated, time.perf_counter() - start)
+
+        batch = copy.deepcopy(projected)
+        start = time.perf_counter()
+        await raw_path(batch)
+        raw = min(raw, time.perf_counter() - start)
+
+    print(
+        f"{name:<8} validated: {validated / n * 1e6:8.1f} us/doc"
+        f"   raw: {raw / n * 1e6:8.1f} us/doc   speedup: {validated / raw:5.1f}x"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares the validated and the raw read path per document"
+    )
+    parser.add_argument("-n", help="Documents per batch", type=int, default=5000)
+    parser.add_argument("--repeat", help="Best of so many runs", type=int, default=5)
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+
+    # beanie models can only be created after the initialization
+    await init_db()
+
+    await measure(
+        "bbox",
+        short_location_doc,
+        LocationShortDb,
+        LocationShortApi,
+        args.n,
+        args.repeat,
+    )
+    await measure(
+        "around",
+        detailed_location_doc,
+        LocationDetailedDb,
+        LocationDetailedApi,
+        args.n,
+        args.repeat,
+    )
+    await measure("offers", offer_doc, Offer, OfferOut, args.n, args.repeat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+"""
+Latency of `/locations/search` autocomplete queries on the in-memory prefix index.
+
+Locations with generated names are inserted into a `PrefixIndex`, then typical
+queries (single letters, word prefixes, several words) are timed. No database
+is needed.
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+
+sys.path.append(".")
+
+from backend.util.text_index import PrefixIndex
+
+KINDS = ["Sportplatz", "Tennisclub", "Bolzplatz", "Schule", "Park", "Halle", "Court"]
+QUERIES = ["s", "sp", "tenn", "sportplatz", "park am", "court b", "zz"]
+
+
+def random_word():
+    return "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measures autocomplete queries on the location search index"
+    )
+    parser.add_argument("-n", help="Indexed locations", type=int, default=1_000_000)
+    parser.add_argument("--repeat", help="Best of so many runs", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(0)
+    words = [random_word() for _ in range(50_000)]
+
+    index: PrefixIndex[int] = PrefixIndex()
+    start = time.perf_counter()
+    for i in range(args.n):
+        name = f"{random.choice(KINDS)} {random.choice(words)} {random.choice(words)}"
+        index.insert(i, [(name, 1.0), (random.choice(words), 0.5)], i)
+    print(f"built index of {args.n} locations in {time.perf_counter() - start:.1f}s")
+
+    for query in QUERIES:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = index.search(query, limit=20)
+            best = min(best, time.perf_counter() - start)
+        print(f"{query!r:<14} {best * 1000:8.2f} ms   {len(results)} results")
+
+
+if __name__ == "__main__":
+    main()
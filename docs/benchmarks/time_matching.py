@@ -0,0 +1,139 @@
+"""
+Matching search windows against many offer times, pair by pair and batched.
+
+Generated offers (single times of one to four hours within a month, some
+flexible) are matched against search windows of a few hours with the per pair
+`TimesMatcher` loop and with the interval tree of `BatchTimesMatcher`. Both
+results are compared. No database is needed.
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Generic, Iterable, TypeVar
+
+sys.path.append(".")
+
+from intervals import IntervalIndex
+
+from backend.database.models.offers import (
+    OfferTime,
+    OfferTimeFlexible,
+    OfferTimeRecurring,
+    OfferTimeSingle,
+    OfferType,
+)
+from backend.database.service.offers import TimesMatcher, recurring_overlaps
+
+START = datetime(2024, 6, 1)
+DAYS = 30
+
+T = TypeVar("T")
+
+
+class BatchTimesMatcher(Generic[T]):
+    """
+    Matches many search times against a fixed set of offer times at once, like
+    `TimesMatcher` for every pair. Single times are kept in an interval tree,
+    so a search time costs O(log n + k log n) instead of a scan of all n.
+    Recurring times are still checked one by one.
+    """
+
+    tm = TimesMatcher()
+
+    def __init__(self, times: Iterable[tuple[T, OfferTime]]) -> None:
+        self._flexible: list[T] = []
+        self._recurring: list[tuple[T, OfferTimeRecurring]] = []
+        singles = []
+        for item, time in times:
+            if time.type == OfferType.FLEXIBLE:
+                self._flexible.append(item)
+            elif time.type == OfferType.RECURRING:
+                self._recurring.append((item, time))
+            else:
+                start, end = time.times
+                singles.append((start, end, item))
+
+        self._single_times = singles
+        self._singles: IntervalIndex[datetime, T] = IntervalIndex(singles)
+        self._all = (
+            self._flexible
+            + [item for item, _ in self._recurring]
+            + [item for _, _, item in singles]
+        )
+
+    def match(self, time: OfferTime) -> list[T]:
+        """The items whose time matches the search time."""
+        if time.type == OfferType.FLEXIBLE:
+            return list(self._all)
+
+        recurring = [item for item, t in self._recurring if self.tm.match(t, time)]
+        if time.type == OfferType.RECURRING:
+            singles = [
+                item
+                for start, end, item in self._single_times
+                if recurring_overlaps(time, start, end)
+            ]
+            return self._flexible + recurring + singles
+
+        start, end = time.times
+        return self._flexible + recurring + list(self._singles.overlapping(start, end))
+
+    def match_many(self, times: Iterable[OfferTime]) -> list[list[T]]:
+        return [self.match(time) for time in times]
+
+
+def random_time(hours: float) -> OfferTimeSingle:
+    start = START + timedelta(minutes=random.randrange(DAYS * 24 * 60))
+    return OfferTimeSingle(times=(start, start + timedelta(hours=hours)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares per pair and batched matching of offer times"
+    )
+    parser.add_argument("-n", help="Offers", type=int, default=10_000)
+    parser.add_argument("-w", help="Search windows", type=int, default=1_000)
+    parser.add_argument("--hours", help="Window length", type=float, default=3)
+    parser.add_argument(
+        "--flexible", help="Share of flexible offers", type=float, default=0.1
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    random.seed(0)
+    offers = [
+        (
+            i,
+            OfferTimeFlexible()
+            if random.random() < args.flexible
+            else random_time(random.uniform(1, 4)),
+        )
+        for i in range(args.n)
+    ]
+    windows = [random_time(args.hours) for _ in range(args.w)]
+    print(f"{args.n} offers, {args.w} windows of {args.hours}h")
+
+    tm = TimesMatcher()
+    start = time.perf_counter()
+    pairwise = [[i for i, t in offers if tm.match(t, w)] for w in windows]
+    print(f"per pair loop   {time.perf_counter() - start:8.3f} s")
+
+    start = time.perf_counter()
+    matcher = BatchTimesMatcher(offers)
+    built = time.perf_counter()
+    batched = matcher.match_many(windows)
+    end = time.perf_counter()
+    print(f"interval tree   {end - start:8.3f} s   (build {built - start:.3f} s)")
+
+    matches = sum(len(m) for m in batched)
+    same = all(sorted(a) == sorted(b) for a, b in zip(pairwise, batched))
+    print(f"{matches} matches, {matches / args.w:.1f} per window, same: {same}")
+
+
+if __name__ == "__main__":
+    main()
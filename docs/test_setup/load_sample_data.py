@@ -8,15 +8,14 @@ from typing import Any, Coroutine
 import munch
 import numpy as np
 import overpass
-from beanie import init_beanie
 from dotenv import load_dotenv
-from motor.motor_asyncio import AsyncIOMotorClient
 
 sys.path.append("../../")
 
-from backend.database.connection import client
+from backend.database.connection import init as init_db
 from backend.database.models.locations import (
     LocationDetailedDb,
+    LocationFacetCell,
     LocationShortDb,
     ReviewsSummary,
 )
@@ -24,18 +23,6 @@ from backend.database.models.shared import LocationCreators
 from backend.database.service import location_service
 from backend.util import constants
 
-client = AsyncIOMotorClient(constants.MONGODB_CONNECTION_STRING)
-
-
-async def init_db():
-    await init_beanie(
-        database=client[constants.DATABASE_NAME], document_models=[LocationDetailedDb]
-    )
-    await init_beanie(
-        database=client[constants.DATABASE_NAME], document_models=[LocationShortDb]
-    )
-
-
 def merge(geometries, centers):
     """Merge center GeoJSON data into geometries as "center" key
 
@@ -145,6 +132,7 @@ async def insert_all_service(elements):
 async def reset_collections():
     await LocationShortDb.find({}).delete()
     await LocationDetailedDb.find({}).delete()
+    await LocationFacetCell.find({}).delete()
 
 
 async def work_tile(tile: list[float]):